@@ -3,75 +3,2708 @@ Embedding Service for Polish Supplement Recommendation System
 Uses multilingual-e5-large model optimized for Polish text processing
 """
 
-from fastapi import FastAPI, HTTPException, status
+import time
+
+# Startup is timed from here so /readyz can report how long imports took
+_import_started = time.perf_counter()
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Literal, Optional, Dict, Any, Union
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from sentence_transformers import CrossEncoder, SentenceTransformer
 import torch
+import asyncio
+import base64
+import glob
+import hashlib
+import io
+import json
 import logging
-import time
+import math
+import os
+import re
+import signal
+import socket
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Global model variable
+model = None
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Default model, loaded at startup; a smaller e5 model can stand in for it on CPU-only hosts
+MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "intfloat/multilingual-e5-large")
+
+# Models this service can serve; MODEL_NAME is loaded at startup, the rest on demand
+AVAILABLE_MODELS = {
+    "intfloat/multilingual-e5-large": {
+        "description": "Multilingual embedding model optimized for Polish text",
+        "dimensions": 1024,
+        "languages": ["Polish", "English", "German", "French", "Spanish", "Italian", "Dutch", "Russian", "Chinese", "Japanese"],
+        "recommended_for": ["supplement descriptions", "health conditions", "medical terms", "user queries"]
+    },
+    "intfloat/multilingual-e5-base": {
+        "description": "Smaller multilingual e5 model balancing quality and latency",
+        "dimensions": 768,
+        "languages": ["Polish", "English", "German", "French", "Spanish", "Italian", "Dutch", "Russian", "Chinese", "Japanese"],
+        "recommended_for": ["ranking on CPU-only nodes"]
+    },
+    "intfloat/multilingual-e5-small": {
+        "description": "Compact multilingual e5 model for latency-sensitive lookups",
+        "dimensions": 384,
+        "languages": ["Polish", "English", "German", "French", "Spanish", "Italian", "Dutch", "Russian", "Chinese", "Japanese"],
+        "recommended_for": ["autocomplete", "short user queries"]
+    },
+}
+if MODEL_NAME not in AVAILABLE_MODELS:
+    raise ValueError(f"EMBEDDING_MODEL_NAME must be one of {', '.join(AVAILABLE_MODELS)}, got '{MODEL_NAME}'")
+# Local weight directories per model, as "name=path,name=path"
+MODEL_SOURCES = dict(
+    entry.split("=", 1) for entry in os.getenv("EMBEDDING_MODEL_SOURCES", "").split(",") if "=" in entry
+)
+# Weight bytes loaded models may use before idle on-demand models are unloaded
+MODEL_MEMORY_BUDGET = int(float(os.getenv("EMBEDDING_MODEL_MEMORY_MB", "6144")) * 1024**2)
+# Local directory with pre-baked (safetensors) weights; the hub is used when unset.
+# Loading copies the tensors into process memory, so separate processes do not share them
+MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH") or None
+# "background" serves /livez immediately and loads the model behind /readyz;
+# "blocking" keeps startup waiting until the model is warm
+LOAD_MODE = os.getenv("EMBEDDING_LOAD_MODE", "background")
+
+# Startup state reported by /readyz
+startup_timings: Dict[str, float] = {"import": time.perf_counter() - _import_started}
+model_state = "loading"
+model_error: Optional[str] = None
+# Weights the launcher loaded before forking this worker
+preloaded_model = None
+
+# Inference backend: torch (fp32), torch-int8, onnx or onnx-int8
+INFERENCE_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+INFERENCE_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_EXPORT_DIR = os.getenv("EMBEDDING_ONNX_DIR", "onnx-models")
+
+# Micro-batching configuration
+MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "64"))
+MAX_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_MAX_BATCH_WAIT_MS", "5"))
+# Padded tokens per forward pass; 0 falls back to fixed-size model.encode batches
+BATCH_TOKEN_BUDGET = int(os.getenv("EMBEDDING_BATCH_TOKEN_BUDGET", "8192"))
+
+# Inference pool and admission control
+INFERENCE_WORKERS = int(os.getenv("EMBEDDING_INFERENCE_WORKERS", "1"))
+MAX_QUEUED_TEXTS = int(os.getenv("EMBEDDING_MAX_QUEUED_TEXTS", "2048"))
+RETRY_AFTER_SECONDS = int(os.getenv("EMBEDDING_RETRY_AFTER_SECONDS", "1"))
+
+# Priority lanes, highest first. Requests pick one with X-Priority; these paths default to bulk
+LANES = ("interactive", "bulk")
+BULK_PATHS = ("/embed/stream", "/index/upsert", "/graph/knn", "/cluster")
+# Share of the inference queue bulk work may hold, so it can never lock interactive requests out
+BULK_QUEUE_FRACTION = float(os.getenv("EMBEDDING_BULK_QUEUE_FRACTION", "0.75"))
+
+# Torch CPU thread pools; 0 keeps torch's defaults (one intra-op thread per core)
+TORCH_THREADS = int(os.getenv("EMBEDDING_TORCH_THREADS", "0"))
+TORCH_INTEROP_THREADS = int(os.getenv("EMBEDDING_TORCH_INTEROP_THREADS", "0"))
+# Launcher: worker processes forked from one copy of the weights, and how to pin them
+# ("none", "cores" or "numa"); intra-op threads default to each worker's share of the CPUs
+WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+WORKER_PINNING = os.getenv("EMBEDDING_WORKER_PINNING", "none")
+
+# Embedding cache: in-memory LRU budget and optional SQLite file that survives restarts
+CACHE_MAX_BYTES = int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "256")) * 1024**2)
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or None
+# /rank keeps passage vectors in their own LRU so a stream of one-off queries cannot evict them
+PASSAGE_CACHE_MAX_BYTES = int(float(os.getenv("EMBEDDING_PASSAGE_CACHE_MAX_MB", "128")) * 1024**2)
+# Token ids per text hash, so repeated texts skip the tokenizer; 0 disables it
+TOKEN_CACHE_MAX_BYTES = int(float(os.getenv("EMBEDDING_TOKEN_CACHE_MAX_MB", "32")) * 1024**2)
+
+# Upper bound on chunks a single chunked /embed request may produce
+MAX_CHUNKS_PER_REQUEST = int(os.getenv("EMBEDDING_MAX_CHUNKS_PER_REQUEST", "1024"))
+CHUNK_RESERVED_TOKENS = 16
+
+# /embed/stream: records per internal batch, batches allowed in flight, longest accepted line
+STREAM_BATCH_SIZE = int(os.getenv("EMBEDDING_STREAM_BATCH_SIZE", "64"))
+STREAM_MAX_INFLIGHT_BATCHES = int(os.getenv("EMBEDDING_STREAM_MAX_INFLIGHT_BATCHES", "4"))
+STREAM_MAX_LINE_BYTES = 1024**2
+STREAM_RETRY_INTERVAL = 0.05
+
+# Corpus index: snapshot directory and approximate (IVF) search settings
+INDEX_PATH = os.getenv("EMBEDDING_INDEX_PATH") or None
+INDEX_NPROBE = int(os.getenv("EMBEDDING_INDEX_NPROBE", "8"))
+INDEX_IVF_MIN_SIZE = int(os.getenv("EMBEDDING_INDEX_IVF_MIN_SIZE", "4096"))
+
+# Hybrid search: BM25 parameters, lexical candidates rescored densely, and the RRF rank offset
+BM25_K1 = float(os.getenv("EMBEDDING_BM25_K1", "1.2"))
+BM25_B = float(os.getenv("EMBEDDING_BM25_B", "0.75"))
+HYBRID_CANDIDATES = int(os.getenv("EMBEDDING_HYBRID_CANDIDATES", "200"))
+RRF_K = int(os.getenv("EMBEDDING_RRF_K", "60"))
+
+# PCA projections for output_dim reduction live next to each model's local weights;
+# EMBEDDING_PCA_PATH points the default model at one elsewhere
+PCA_FILENAME = "pca.npz"
+PCA_PATH = os.getenv("EMBEDDING_PCA_PATH") or None
+
+# Score tile size cap for the kNN graph and duplicate detection, and the magic/version
+# of the binary kNN graph layout
+KNN_GRAPH_BLOCK_BYTES = int(float(os.getenv("EMBEDDING_KNN_GRAPH_BLOCK_MB", "256")) * 1024**2)
+KNN_GRAPH_MAGIC = b"KNNG"
+KNN_GRAPH_VERSION = 1
+
+# Optional cross-encoder rerank for /similarity, e.g. cross-encoder/mmarco-mMiniLMv2-L12-H384-v1;
+# reranking is off unless a model is configured
+RERANK_MODEL_NAME = os.getenv("EMBEDDING_RERANK_MODEL") or None
+RERANK_MODEL_PATH = os.getenv("EMBEDDING_RERANK_MODEL_PATH") or None
+RERANK_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_RERANK_MAX_BATCH_SIZE", "32"))
+# Per-request caps: (query, passage) pairs scored, and time before falling back to bi-encoder order
+RERANK_MAX_PAIRS = int(os.getenv("EMBEDDING_RERANK_MAX_PAIRS", "100"))
+RERANK_TIME_BUDGET_MS = float(os.getenv("EMBEDDING_RERANK_TIME_BUDGET_MS", "200"))
+RERANK_CACHE_ENTRIES = int(os.getenv("EMBEDDING_RERANK_CACHE_ENTRIES", "100000"))
+
+# Prometheus metrics, served from /metrics
+STAGE_SECONDS = Histogram(
+    "embedding_stage_seconds",
+    "Time spent in each stage of the embedding pipeline",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+BATCH_SIZE = Histogram(
+    "embedding_batch_size_texts",
+    "Texts per coalesced inference batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+)
+TEXTS_TOTAL = Counter("embedding_texts_total", "Texts run through the model")
+TOKENS_TOTAL = Counter("embedding_tokens_total", "Unpadded tokens run through the model")
+LANE_QUEUE_WAIT_SECONDS = Histogram(
+    "embedding_lane_queue_wait_seconds",
+    "Time texts wait for inference, per priority lane",
+    ["lane"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+DEADLINE_DROPS_TOTAL = Counter(
+    "embedding_deadline_dropped_texts_total",
+    "Texts dropped before inference because their request deadline passed",
+    ["model", "lane"]
+)
+RERANK_FALLBACKS_TOTAL = Counter(
+    "embedding_rerank_fallbacks_total",
+    "Rerank requests answered in bi-encoder order because the time budget ran out"
+)
+DEDUPLICATED_TOTAL = Counter(
+    "embedding_deduplicated_texts_total",
+    "Texts that reused another copy's embedding instead of being encoded",
+    ["scope"]
+)
+
+class ChunkingOptions(BaseModel):
+    # Tokens per chunk; defaults to the model's sequence length minus room for prefix and special tokens
+    window: Optional[int] = Field(None, ge=8)
+    # Tokens between chunk starts; defaults to the window (no overlap)
+    stride: Optional[int] = Field(None, ge=1)
+    pooling: Literal["none", "mean", "weighted"] = "mean"
+
+class EmbeddingRequest(BaseModel):
+    texts: Optional[List[str]] = Field(None, min_items=1, max_items=100)
+    # Instead of texts: ids from the model's tokenizer for the prefixed texts, special tokens included
+    token_ids: Optional[List[List[int]]] = Field(None, min_items=1, max_items=100)
+    normalize: bool = True
+    model_name: Optional[str] = None
+    # Only used by /embed; dtype applies to the binary and base64 encodings
+    encoding_format: Literal["float", "base64"] = "float"
+    dtype: Literal["float32", "float16"] = "float32"
+    chunking: Optional[ChunkingOptions] = None
+    # Fewer dimensions per vector: the leading ones ("truncate") or the model's PCA projection ("pca")
+    output_dim: Optional[int] = Field(None, ge=1)
+    reduction: Literal["truncate", "pca"] = "truncate"
+
+class SimilarityRequest(BaseModel):
+    texts: List[str] = Field(..., min_items=1, max_items=100)
+    # When given, texts are scored against this list instead of each other
+    corpus: Optional[List[str]] = Field(None, min_items=1, max_items=1000)
+    normalize: bool = True
+    model_name: Optional[str] = None
+    upper_triangle: bool = False
+    top_k: Optional[int] = Field(None, ge=1)
+    # Rerank each query's best bi-encoder matches in the corpus with the cross-encoder
+    rerank: bool = False
+    # Bi-encoder candidates per query to rerank, capped by EMBEDDING_RERANK_MAX_PAIRS per request
+    rerank_candidates: Optional[int] = Field(None, ge=1)
+    # Clients may ask for less time than EMBEDDING_RERANK_TIME_BUDGET_MS, never more
+    rerank_budget_ms: float = Field(RERANK_TIME_BUDGET_MS, gt=0, le=RERANK_TIME_BUDGET_MS)
+
+class IndexDocument(BaseModel):
+    id: str
+    text: str
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+class IndexUpsertRequest(BaseModel):
+    documents: List[IndexDocument] = Field(..., min_items=1, max_items=256)
+
+class IndexDeleteRequest(BaseModel):
+    ids: List[str] = Field(..., min_items=1)
+
+class KnnGraphRequest(BaseModel):
+    # Nodes to embed and link; the corpus index is used when omitted
+    nodes: Optional[List[IndexDocument]] = Field(None, min_items=2, max_items=10000)
+    k: int = Field(10, ge=1, le=100)
+    # Drop edges scoring below this, so rows may hold fewer than k neighbours
+    min_score: Optional[float] = None
+    model_name: Optional[str] = None
+
+class ClusterRequest(BaseModel):
+    # Documents to embed and group; the corpus index is used when omitted
+    documents: Optional[List[IndexDocument]] = Field(None, min_items=2, max_items=20000)
+    # Cosine similarity at which two documents count as duplicates
+    threshold: float = Field(0.95, ge=0.5, le=1.0)
+    # Also assign every document to one of this many k-means clusters
+    n_clusters: Optional[int] = Field(None, ge=2, le=1000)
+    model_name: Optional[str] = None
+
+class SearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_items=1, max_items=100)
+    top_k: int = Field(10, ge=1, le=1000)
+    approximate: bool = False
+    nprobe: int = Field(INDEX_NPROBE, ge=1)
+    mode: Literal["dense", "lexical", "hybrid"] = "dense"
+    # Hybrid only: BM25 candidates rescored with their vectors, and how the two rankings combine
+    candidates: int = Field(HYBRID_CANDIDATES, ge=1, le=10000)
+    fusion: Literal["rrf", "weighted"] = "rrf"
+    # Weight of the dense score in weighted fusion; BM25 scores are scaled to [0, 1] first
+    alpha: float = Field(0.5, ge=0.0, le=1.0)
+
+class RankRequest(BaseModel):
+    query: str
+    # Either ids of corpus index documents or raw passage texts
+    passage_ids: Optional[List[str]] = Field(None, min_items=1, max_items=10000)
+    passages: Optional[List[str]] = Field(None, min_items=1, max_items=1000)
+    top_k: Optional[int] = Field(None, ge=1)
+    model_name: Optional[str] = None
+
+class EmbeddingResponse(BaseModel):
+    embeddings: List[List[float]]
+    model: str
+    processing_time: float
+    device: str
+
+class HealthResponse(BaseModel):
+    status: str
+    model: str
+    device: str
+    memory_usage: Dict[str, Any]
+    queue: Dict[str, Any]
+    cache: Dict[str, Any]
+    index: Dict[str, Any]
+
+# Media types /embed can answer with besides JSON
+NPY_MEDIA_TYPE = "application/x-npy"
+RAW_MEDIA_TYPE = "application/octet-stream"
+
+def prefix_texts(texts: List[str], default_prefix: str = "passage: ") -> List[str]:
+    """Add the e5 prefix to texts that do not carry one already"""
+    return [text if text.startswith(("query:", "passage:")) else default_prefix + text for text in texts]
+
+def split_prefix(text: str, default_prefix: str = "passage: ") -> tuple:
+    """Split a text into its e5 prefix and body, returning (prefix, body, body offset)"""
+    for prefix in ("query:", "passage:"):
+        if text.startswith(prefix):
+            body_start = len(prefix) + (len(text) - len(prefix) - len(text[len(prefix):].lstrip()))
+            return f"{prefix} ", text[body_start:], body_start
+    return default_prefix, text, 0
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize each row, leaving all-zero rows untouched"""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+def load_projection(path: Optional[str]) -> Optional[Dict[str, np.ndarray]]:
+    """Load a PCA projection (``mean`` and variance-ordered ``components``) if the file exists"""
+    if not path or not os.path.isfile(path):
+        return None
+    with np.load(path) as data:
+        return {
+            "mean": data["mean"].astype(np.float32),
+            "components": data["components"].astype(np.float32),
+        }
+
+def reduce_dimensions(
+    embeddings: np.ndarray,
+    output_dim: int,
+    projection: Optional[Dict[str, np.ndarray]] = None,
+    normalize: bool = True
+) -> np.ndarray:
+    """Keep ``output_dim`` dimensions: the leading ones, or the top PCA components"""
+    if projection is None:
+        reduced = embeddings[:, :output_dim]
+    else:
+        reduced = (embeddings - projection["mean"]) @ projection["components"][:output_dim].T
+    if normalize:
+        reduced = normalize_rows(reduced)
+    return np.ascontiguousarray(reduced, dtype=np.float32)
+
+def similarity_matrix(
+    queries: np.ndarray,
+    targets: np.ndarray,
+    pairwise: bool = False,
+    normalized: bool = True
+) -> np.ndarray:
+    """Score every query row against every target row with one matrix multiply"""
+    scores = queries @ targets.T
+    if pairwise and normalized:
+        # Keep self-similarity exact rather than 0.9999999
+        np.fill_diagonal(scores, 1.0)
+    return scores
+
+def top_k_neighbours(scores: np.ndarray, k: int, exclude_self: bool = False) -> List[List[Dict[str, Any]]]:
+    """Best k columns of each score row, highest first"""
+    if exclude_self:
+        scores = scores.copy()
+        np.fill_diagonal(scores, -np.inf)
+        k = min(k, scores.shape[1] - 1)
+    else:
+        k = min(k, scores.shape[1])
+
+    if k <= 0:
+        return [[] for _ in range(scores.shape[0])]
+
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    return [
+        [{"index": int(index), "score": float(score)} for index, score in zip(row_indices, row_scores)]
+        for row_indices, row_scores in zip(top, top_scores)
+    ]
+
+def knn_graph(
+    vectors: np.ndarray,
+    k: int,
+    min_score: Optional[float] = None,
+    max_block_bytes: int = KNN_GRAPH_BLOCK_BYTES
+) -> tuple:
+    """Each row's k most similar other rows as CSR arrays (indptr, indices, scores), best first
+
+    Scores are computed in square tiles. Each tile is cut down to its own
+    top-k before being merged into the running top-k of its row block, so
+    the tile's float32 scores plus the int64 positions ``argpartition``
+    returns for them stay within ``max_block_bytes``; the merge only touches
+    ``rows x 2k`` arrays.
+    """
+    n = len(vectors)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.zeros(n + 1, dtype=np.uint32), np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.float32)
+
+    # 4 bytes of score and 8 of argpartition position per tile entry
+    block = max(1, min(n, int(np.sqrt(max_block_bytes / 12))))
+    indices = np.empty((n, k), dtype=np.uint32)
+    scores = np.empty((n, k), dtype=np.float32)
+    for row_start in range(0, n, block):
+        rows = vectors[row_start:row_start + block]
+        best_scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+        best_indices = np.zeros((len(rows), k), dtype=np.int64)
+        for column_start in range(0, n, block):
+            tile = rows @ vectors[column_start:column_start + block].T
+            # Leave each row out of its own neighbours
+            shared = np.arange(max(row_start, column_start), min(row_start + len(rows), column_start + tile.shape[1]))
+            tile[shared - row_start, shared - column_start] = -np.inf
+
+            # Negate in place so partitioning needs no second float copy of the tile
+            np.negative(tile, out=tile)
+            if tile.shape[1] > k:
+                top = np.argpartition(tile, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(tile.shape[1]), tile.shape)
+            tile_scores = -np.take_along_axis(tile, top, axis=1)
+            tile_indices = top + column_start
+            del tile, top
+
+            candidate_scores = np.concatenate([best_scores, tile_scores], axis=1)
+            candidate_indices = np.concatenate([best_indices, tile_indices], axis=1)
+            merged = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(candidate_scores, merged, axis=1)
+            best_indices = np.take_along_axis(candidate_indices, merged, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        scores[row_start:row_start + len(rows)] = np.take_along_axis(best_scores, order, axis=1)
+        indices[row_start:row_start + len(rows)] = np.take_along_axis(best_indices, order, axis=1)
+
+    keep = np.ones_like(scores, dtype=bool) if min_score is None else scores >= min_score
+    indptr = np.zeros(n + 1, dtype=np.uint32)
+    np.cumsum(keep.sum(axis=1), out=indptr[1:])
+    return indptr, indices[keep], scores[keep]
+
+def duplicate_groups(
+    vectors: np.ndarray,
+    threshold: float,
+    max_block_bytes: int = KNN_GRAPH_BLOCK_BYTES
+) -> np.ndarray:
+    """Label rows by connected component of the "cosine similarity >= threshold" graph
+
+    Only tiles on or above the diagonal are scored. Each tile's matching
+    pairs are merged into a union-find forest over the rows, a strip of
+    tile rows at a time, before the next tile is scored. Half of
+    ``max_block_bytes`` holds the tile's scores and the other half the
+    pairs of one strip with their root lookups, so memory stays within the
+    cap plus O(rows) however low the threshold. Labels are the smallest row
+    index of each group.
+    """
+    n = len(vectors)
+    block = max(1, min(n, int(np.sqrt(max_block_bytes / 2 / 4))))
+    parents = np.arange(n)
+
+    def find(rows: np.ndarray) -> np.ndarray:
+        roots = parents[rows]
+        while True:
+            above = parents[roots]
+            if np.array_equal(above, roots):
+                return roots
+            roots = above
+
+    for row_start in range(0, n, block):
+        rows = vectors[row_start:row_start + block]
+        for column_start in range(row_start, n, block):
+            tile = rows @ vectors[column_start:column_start + block].T
+            # A matching entry costs about 80 bytes of positions, roots and masks while linked
+            strip = max(1, int(max_block_bytes / 2 / 80 / tile.shape[1]))
+            for strip_start in range(0, len(tile), strip):
+                sources, targets = np.nonzero(tile[strip_start:strip_start + strip] >= threshold)
+                sources += row_start + strip_start
+                targets += column_start
+                if column_start == row_start:
+                    # Each pair once, and no row paired with itself
+                    above = sources < targets
+                    sources, targets = sources[above], targets[above]
+
+                # Link roots until every matching pair shares one; roots only ever point to smaller rows
+                while len(sources):
+                    source_roots, target_roots = find(sources), find(targets)
+                    split = source_roots != target_roots
+                    sources, targets = sources[split], targets[split]
+                    source_roots, target_roots = source_roots[split], target_roots[split]
+                    np.minimum.at(parents, np.maximum(source_roots, target_roots), np.minimum(source_roots, target_roots))
+            del tile
+            # Flatten the forest so later lookups stay short
+            parents = find(np.arange(n))
+
+    return parents
+
+
+def encode_knn_graph(ids: List[str], indptr: np.ndarray, indices: np.ndarray, scores: np.ndarray) -> bytes:
+    """Pack a kNN graph into one little-endian buffer a browser can read with a single fetch
+
+    Layout: ``KNNG``, then uint32 version, node count and edge count, then
+    uint32 ``indptr[nodes + 1]``, uint32 ``indices[edges]``, float32
+    ``scores[edges]`` and finally the node ids as a UTF-8 JSON array. Every
+    array starts 4-byte aligned, so it can be viewed in place as a
+    Uint32Array or Float32Array.
+    """
+    header = KNN_GRAPH_MAGIC + np.array([KNN_GRAPH_VERSION, len(ids), len(indices)], dtype="<u4").tobytes()
+    return b"".join([
+        header,
+        np.asarray(indptr, dtype="<u4").tobytes(),
+        np.asarray(indices, dtype="<u4").tobytes(),
+        np.asarray(scores, dtype="<f4").tobytes(),
+        json.dumps(ids, ensure_ascii=False).encode("utf-8"),
+    ])
+
+class OnnxEmbeddingModel:
+    """ONNX Runtime stand-in for the parts of SentenceTransformer this service uses.
+
+    The transformer is exported once with optimum (and optionally quantized
+    to dynamic int8) into ``ONNX_EXPORT_DIR``; later starts load the export
+    directly. Pooling mirrors the e5 training setup: attention-masked mean.
+    """
+
+    def __init__(self, model_name: str, quantize: bool = False, export_dir: str = ONNX_EXPORT_DIR):
+        # Optional dependencies, only needed for the ONNX backends
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        model_dir = os.path.join(export_dir, model_name.replace("/", "--"))
+        if not os.path.exists(os.path.join(model_dir, "model.onnx")):
+            logger.info(f"Exporting {model_name} to ONNX in {model_dir}")
+            exported = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            exported.save_pretrained(model_dir)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+
+        file_name = "model.onnx"
+        if quantize:
+            file_name = "model_quantized.onnx"
+            if not os.path.exists(os.path.join(model_dir, file_name)):
+                from optimum.onnxruntime import ORTQuantizer
+                from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+                logger.info(f"Quantizing ONNX export of {model_name} to dynamic int8")
+                quantizer = ORTQuantizer.from_pretrained(model_dir, file_name="model.onnx")
+                quantizer.quantize(
+                    save_dir=model_dir,
+                    quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+                )
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name=file_name)
+        self.model_bytes = os.path.getsize(os.path.join(model_dir, file_name))
+        self.max_seq_length = min(self.tokenizer.model_max_length, 512)
+
+    def get_max_seq_length(self) -> int:
+        return self.max_seq_length
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.config.hidden_size
+
+    def encode(
+        self,
+        sentences: List[str],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        show_progress_bar: bool = False
+    ) -> np.ndarray:
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            batches.append(self.embed_features(inputs))
+
+        embeddings = np.concatenate(batches).astype(np.float32)
+        return normalize_rows(embeddings) if normalize_embeddings else embeddings
+
+    def embed_features(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """Mean-pooled embeddings for one padded, tokenized batch"""
+        hidden = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+def load_model(model_name: str, backend: str = INFERENCE_BACKEND):
+    """Load ``model_name`` with the selected inference backend.
+
+    ``torch`` runs the stock SentenceTransformer in fp32 on ``device``;
+    ``torch-int8`` applies dynamic int8 quantization to its Linear layers and
+    ``onnx`` / ``onnx-int8`` run an ONNX Runtime export. The quantized and
+    ONNX backends always run on CPU.
+    """
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {INFERENCE_BACKENDS}")
+
+    if backend == "torch":
+        return SentenceTransformer(model_name, device=device)
+
+    if backend == "torch-int8":
+        fp32_model = SentenceTransformer(model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(fp32_model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    return OnnxEmbeddingModel(model_name, quantize=backend == "onnx-int8")
+
+def tokenize_texts(model, texts: List[str]) -> List[List[int]]:
+    """Token ids for each text, truncated to the model's sequence length but not padded"""
+    encoded = model.tokenizer(
+        # SentenceTransformer strips inputs before tokenizing; keep ids identical
+        [text.strip() for text in texts],
+        truncation=True,
+        max_length=model.get_max_seq_length()
+    )
+    return encoded["input_ids"]
+
+def embed_token_batch(model, token_ids: List[List[int]]) -> np.ndarray:
+    """Pad one batch of token ids to its longest member and run the model on it"""
+    if isinstance(model, OnnxEmbeddingModel):
+        features = model.tokenizer.pad({"input_ids": token_ids}, padding=True, return_tensors="np")
+        return model.embed_features(dict(features))
+
+    features = model.tokenizer.pad({"input_ids": token_ids}, padding=True, return_tensors="pt")
+    with torch.inference_mode():
+        features = {name: tensor.to(device) for name, tensor in features.items()}
+        embeddings = model(features)["sentence_embedding"]
+    return embeddings.float().cpu().numpy()
+
+def plan_length_buckets(lengths: np.ndarray, token_budget: int, max_batch_size: int) -> List[np.ndarray]:
+    """Group text indices into batches of similar token length.
+
+    Texts are taken longest first and a batch is closed once adding another
+    text would push its padded size (count * longest length) past
+    ``token_budget`` or its count past ``max_batch_size``.
+    """
+    order = np.argsort(-lengths, kind="stable")
+    batches = []
+    start = 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        count = max(1, min(max_batch_size, token_budget // longest))
+        batches.append(order[start:start + count])
+        start += count
+    return batches
+
+class TokenCache:
+    """LRU of token ids keyed by a hash of the text they were produced from.
+
+    Bounded by the bytes of the stored ids. A batcher's inference threads
+    share one instance, so every access holds the lock.
+    """
+
+    def __init__(self, max_bytes: int = TOKEN_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def tokenize(self, model, texts: List[str]) -> List[List[int]]:
+        """Token ids for each text, running the tokenizer only on texts not seen before"""
+        if self.max_bytes <= 0:
+            return tokenize_texts(model, texts)
+
+        keys = [self.key(text) for text in texts]
+        token_ids: List[Optional[List[int]]] = [None] * len(texts)
+        with self._lock:
+            for i, key in enumerate(keys):
+                ids = self._entries.get(key)
+                if ids is not None:
+                    self._entries.move_to_end(key)
+                    token_ids[i] = ids.tolist()
+            missing = [i for i, ids in enumerate(token_ids) if ids is None]
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            tokenized = tokenize_texts(model, [texts[i] for i in missing])
+            with self._lock:
+                for i, ids in zip(missing, tokenized):
+                    token_ids[i] = ids
+                    self._remember(keys[i], np.asarray(ids, dtype=np.int32))
+        return token_ids
+
+    def _remember(self, key: bytes, ids: np.ndarray):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.current_bytes -= previous.nbytes
+        self._entries[key] = ids
+        self.current_bytes += ids.nbytes
+
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+# Lane and deadline (event loop time) of the request being served, set by request_scheduling
+request_lane: ContextVar[str] = ContextVar("request_lane", default="interactive")
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+def deadline_passed() -> bool:
+    deadline = request_deadline.get()
+    return deadline is not None and asyncio.get_running_loop().time() >= deadline
+
+@dataclass
+class PendingEncode:
+    # Prefixed texts, or tuples of token ids for pre-tokenized inputs
+    texts: List[Union[str, tuple]]
+    future: asyncio.Future
+    enqueued_at: float = 0.0
+    lane: str = "interactive"
+    dispatched: bool = False
+
+class QueueFullError(Exception):
+    """Raised when the inference queue cannot admit more texts"""
+
+class DeadlineExceededError(Exception):
+    """Raised when a request's deadline passes before its texts were embedded"""
+
+class EmbeddingBatcher:
+    """Coalesces texts from concurrent requests into shared model batches.
+
+    Callers submit their (already prefixed) texts and await a future. A single
+    collector task gathers submissions until either ``max_batch_size`` texts
+    are queued or ``max_wait_ms`` has passed since the first one arrived, then
+    hands the batch to the inference thread pool and each caller gets its own
+    slice back. Up to ``workers`` batches run at once, so the event loop (and
+    ``/health``) stays responsive while the model is busy.
+
+    Admission is bounded by ``max_queued_texts``: texts waiting for or inside
+    an encode count against it, and ``encode`` raises ``QueueFullError``
+    instead of queueing past the limit. Bulk work may only fill
+    ``BULK_QUEUE_FRACTION`` of it.
+
+    Submissions wait in one queue per priority lane. The collector always
+    starts a batch from the highest lane with work queued and never mixes
+    lanes; a bulk batch stops growing as soon as interactive work arrives.
+    Bulk submissions are split into ``max_batch_size`` pieces, so
+    interactive requests overtake queued bulk work at every batch boundary.
+    Callers stop waiting once their request deadline passes, and texts not
+    yet dispatched by then are dropped instead of embedded.
+
+    Inside a batch, texts are tokenized once and regrouped into length
+    buckets whose padded size stays under ``token_budget`` tokens, so short
+    queries are not padded to the length of long passages. Results are
+    written back in submission order.
+
+    Embeddings are computed unnormalized so requests with different
+    ``normalize`` flags can share a batch.
+
+    Token ids of recently seen texts come from a ``TokenCache``, and
+    submissions may carry tuples of token ids in place of texts, which skip
+    tokenization altogether.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_BATCH_WAIT_MS,
+        workers: int = INFERENCE_WORKERS,
+        max_queued_texts: int = MAX_QUEUED_TEXTS,
+        token_budget: int = BATCH_TOKEN_BUDGET,
+        model=None,
+        name: str = MODEL_NAME,
+    ):
+        # Model label on this batcher's metrics
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = workers
+        self.max_queued_texts = max_queued_texts
+        self.token_budget = token_budget
+        self.model = model
+        self.token_cache = TokenCache()
+        self.queued_texts = 0
+        # Padding counters, updated from inference threads
+        self._stats_lock = threading.Lock()
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.unbucketed_padded_tokens = 0
+        self.forward_batches = 0
+        self.lane_queued_texts = {lane: 0 for lane in LANES}
+        self.dropped_texts = {lane: 0 for lane in LANES}
+        self._queues: Optional[Dict[str, deque]] = None
+        self._arrived: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight: set = set()
+
+    def start(self):
+        self._queues = {lane: deque() for lane in LANES}
+        self._arrived = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._slots = asyncio.Semaphore(self.workers)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        # Let batches already handed to the pool finish before tearing it down
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        # Fail anything still waiting so callers do not hang on shutdown
+        for queue in (self._queues or {}).values():
+            while queue:
+                pending = queue.popleft()
+                if not pending.future.done():
+                    pending.future.set_exception(RuntimeError("Embedding service is shutting down"))
+
+    async def encode(self, texts: List[Union[str, tuple]]) -> np.ndarray:
+        """Queue texts in the request's lane and wait for their embeddings or its deadline"""
+        if self._queues is None:
+            raise RuntimeError("Embedding batcher is not running")
+
+        lane = request_lane.get()
+        deadline = request_deadline.get()
+        loop = asyncio.get_running_loop()
+        if deadline is not None and loop.time() >= deadline:
+            self._drop(lane, len(texts))
+            raise DeadlineExceededError("Request deadline passed before inference")
+
+        limit = self.max_queued_texts if lane == "interactive" else int(self.max_queued_texts * BULK_QUEUE_FRACTION)
+        if self.queued_texts + len(texts) > limit:
+            raise QueueFullError(
+                f"Inference queue is full for {lane} requests ({self.queued_texts}/{limit} texts)"
+            )
+
+        if lane == "interactive":
+            pieces = [texts]
+        else:
+            pieces = [texts[i:i + self.max_batch_size] for i in range(0, len(texts), self.max_batch_size)]
+
+        self.queued_texts += len(texts)
+        self.lane_queued_texts[lane] += len(texts)
+        try:
+            submitted = []
+            for piece in pieces:
+                pending = PendingEncode(
+                    texts=piece, future=loop.create_future(), enqueued_at=loop.time(), lane=lane
+                )
+                self._queues[lane].append(pending)
+                submitted.append(pending)
+            self._arrived.set()
+
+            waiter = asyncio.gather(*(pending.future for pending in submitted))
+            if deadline is None:
+                results = await waiter
+            else:
+                try:
+                    results = await asyncio.wait_for(waiter, deadline - loop.time())
+                except asyncio.TimeoutError:
+                    # Cancelled futures are skipped by the collector
+                    self._drop(lane, sum(len(p.texts) for p in submitted if not p.dispatched))
+                    raise DeadlineExceededError("Request deadline passed while queued for inference")
+            return results[0] if len(results) == 1 else np.concatenate(results)
+        finally:
+            self.queued_texts -= len(texts)
+            self.lane_queued_texts[lane] -= len(texts)
+
+    def _drop(self, lane: str, count: int):
+        if count:
+            self.dropped_texts[lane] += count
+            DEADLINE_DROPS_TOTAL.labels(self.name, lane).inc(count)
+
+    async def _collect(self) -> List[PendingEncode]:
+        loop = asyncio.get_running_loop()
+        while True:
+            lane = next((lane for lane in LANES if self._queues[lane]), None)
+            if lane is not None:
+                break
+            self._arrived.clear()
+            await self._arrived.wait()
+
+        queue = self._queues[lane]
+        batch = [queue.popleft()]
+        size = len(batch[0].texts)
+        deadline = loop.time() + self.max_wait
+
+        while size < self.max_batch_size:
+            # Higher lanes pre-empt the rest of this batch
+            if any(self._queues[higher] for higher in LANES[:LANES.index(lane)]):
+                break
+            if queue:
+                pending = queue.popleft()
+                batch.append(pending)
+                size += len(pending.texts)
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+        # Callers that disconnected or ran out of time while queued are dropped here
+        return [pending for pending in batch if not pending.future.done()]
+
+    async def _run(self):
+        while True:
+            # Wait for a free worker first so the next batch keeps growing
+            # while every worker is busy
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            if not batch:
+                self._slots.release()
+                continue
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[PendingEncode]):
+        loop = asyncio.get_running_loop()
+        texts = [text for pending in batch for text in pending.texts]
+        dispatched_at = loop.time()
+        for pending in batch:
+            pending.dispatched = True
+            STAGE_SECONDS.labels("queue_wait").observe(dispatched_at - pending.enqueued_at)
+            LANE_QUEUE_WAIT_SECONDS.labels(pending.lane).observe(dispatched_at - pending.enqueued_at)
+        BATCH_SIZE.observe(len(texts))
+        TEXTS_TOTAL.inc(len(texts))
+        try:
+            embeddings = await loop.run_in_executor(self._executor, self._encode, texts)
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        offset = 0
+        for pending in batch:
+            count = len(pending.texts)
+            if not pending.future.done():
+                pending.future.set_result(embeddings[offset:offset + count])
+            offset += count
+
+    def _tokenize(self, texts: List[Union[str, tuple]]) -> List[List[int]]:
+        """Token ids for a batch: cached or freshly tokenized texts, pre-tokenized inputs as given"""
+        token_ids: List[Optional[List[int]]] = [
+            None if isinstance(text, str) else list(text) for text in texts
+        ]
+        raw = [i for i, ids in enumerate(token_ids) if ids is None]
+        if raw:
+            for i, ids in zip(raw, self.token_cache.tokenize(self.model, [texts[i] for i in raw])):
+                token_ids[i] = ids
+        return token_ids
+
+    def _encode(self, texts: List[Union[str, tuple]]) -> np.ndarray:
+        pretokenized = not all(isinstance(text, str) for text in texts)
+        if self.token_budget <= 0 and not pretokenized:
+            # Tokenization happens inside encode and is counted as forward time here
+            with STAGE_SECONDS.labels("forward").time():
+                return self.model.encode(
+                    texts,
+                    convert_to_numpy=True,
+                    normalize_embeddings=False,
+                    batch_size=self.max_batch_size,
+                    show_progress_bar=False
+                )
+
+        # Tokenize once, then run length-sorted batches sized by padded tokens
+        with STAGE_SECONDS.labels("tokenization").time():
+            token_ids = self._tokenize(texts)
+        lengths = np.array([len(ids) for ids in token_ids])
+        # Without a budget, pre-tokenized inputs still run in fixed-size batches
+        token_budget = self.token_budget if self.token_budget > 0 else self.max_batch_size * int(lengths.max())
+        buckets = plan_length_buckets(lengths, token_budget, self.max_batch_size)
+
+        embeddings = None
+        padded_tokens = 0
+        for bucket in buckets:
+            with STAGE_SECONDS.labels("forward").time():
+                vectors = embed_token_batch(self.model, [token_ids[i] for i in bucket])
+            if embeddings is None:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[bucket] = vectors
+            padded_tokens += len(bucket) * int(lengths[bucket].max())
+
+        # What fixed-size batches in arrival order would have padded to
+        unbucketed_tokens = sum(
+            len(chunk) * int(chunk.max())
+            for chunk in np.array_split(lengths, range(self.max_batch_size, len(lengths), self.max_batch_size))
+        )
+        TOKENS_TOTAL.inc(int(lengths.sum()))
+        with self._stats_lock:
+            self.real_tokens += int(lengths.sum())
+            self.padded_tokens += padded_tokens
+            self.unbucketed_padded_tokens += unbucketed_tokens
+            self.forward_batches += len(buckets)
+
+        return embeddings
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued_texts": self.queued_texts,
+            "max_queued_texts": self.max_queued_texts,
+            "workers": self.workers,
+            "busy_workers": len(self._inflight),
+            "token_budget": self.token_budget,
+            "forward_batches": self.forward_batches,
+            "real_tokens": self.real_tokens,
+            "padded_tokens": self.padded_tokens,
+            "padding_efficiency": self.real_tokens / self.padded_tokens if self.padded_tokens else 1.0,
+            "padded_tokens_saved": self.unbucketed_padded_tokens - self.padded_tokens,
+            "token_cache": self.token_cache.stats(),
+            "lanes": {
+                lane: {"queued_texts": self.lane_queued_texts[lane], "dropped_texts": self.dropped_texts[lane]}
+                for lane in LANES
+            },
+        }
+
+batcher = EmbeddingBatcher()
+
+class RerankBatcher(EmbeddingBatcher):
+    """Batches (query, passage) pairs from concurrent requests through the cross-encoder.
+
+    Queueing, priority lanes, deadlines and admission work as for
+    embeddings; submissions carry pairs instead of texts and come back as
+    one relevance score per pair.
+    """
+
+    def _encode(self, pairs: List[tuple]) -> np.ndarray:
+        with STAGE_SECONDS.labels("rerank").time():
+            scores = self.model.predict(
+                pairs,
+                batch_size=self.max_batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        return np.asarray(scores, dtype=np.float32).reshape(len(pairs))
+
+rerank_batcher = RerankBatcher(
+    max_batch_size=RERANK_MAX_BATCH_SIZE, token_budget=0, name=RERANK_MODEL_NAME or "reranker"
+)
+
+class ScoreCache:
+    """LRU of cross-encoder scores keyed on a hash of (model, query, passage)"""
+
+    def __init__(self, max_entries: int = RERANK_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, float]" = OrderedDict()
+
+    @staticmethod
+    def key(model_name: str, query: str, passage: str) -> bytes:
+        return hashlib.blake2b(f"{model_name}\0{query}\0{passage}".encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[float]:
+        score = self._entries.get(key)
+        if score is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return score
+
+    def put(self, key: bytes, score: float):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = score
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+rerank_cache = ScoreCache()
+
+def queue_full_exception(error: QueueFullError) -> HTTPException:
+    """503 telling clients when to retry an overloaded inference queue"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(error),
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+def deadline_exception(error: DeadlineExceededError) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(error))
+
+async def request_scheduling(
+    request: Request,
+    x_priority: Optional[str] = Header(None),
+    x_request_deadline_ms: Optional[float] = Header(None)
+):
+    """Read the request's priority lane and deadline into the context the batcher sees.
+
+    ``X-Priority`` picks a lane (bulk paths default to ``bulk``);
+    ``X-Request-Deadline-Ms`` is how long the caller will wait, counted from
+    now.
+    """
+    lane = x_priority or ("bulk" if request.url.path in BULK_PATHS else "interactive")
+    if lane not in LANES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"X-Priority must be one of {', '.join(LANES)}"
+        )
+    request_lane.set(lane)
+    request_deadline.set(
+        None if x_request_deadline_ms is None
+        else asyncio.get_running_loop().time() + x_request_deadline_ms / 1000.0
+    )
+
+class UnknownModelError(ValueError):
+    """Raised when a request names a model the registry does not serve"""
+
+@dataclass
+class RegisteredModel:
+    name: str
+    source: str
+    info: Dict[str, Any]
+    pinned: bool = False
+    model: Any = None
+    batcher: Optional[EmbeddingBatcher] = None
+    memory_bytes: int = 0
+    last_used: float = 0.0
+    active: int = 0
+    lock: Optional[asyncio.Lock] = None
+    projection: Optional[Dict[str, np.ndarray]] = None
+    # Model name, backend and weights identity; embedding cache keys start with it
+    cache_namespace: str = ""
+
+def weights_fingerprint(source: str) -> str:
+    """Identify the weights behind ``source`` for embedding cache keys
+
+    Local directories are identified by the names, sizes and modification
+    times of their files (the PCA projection aside), so weights re-baked
+    at the same path get fresh cache entries. Hub names stand for
+    themselves.
+    """
+    if not os.path.isdir(source):
+        return source
+    digest = hashlib.sha256()
+    for root, _, files in sorted(os.walk(source)):
+        for name in sorted(files):
+            if name == PCA_FILENAME:
+                continue
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, source)}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def estimate_model_bytes(model) -> int:
+    """Bytes held by a loaded model's weights"""
+    if isinstance(model, OnnxEmbeddingModel):
+        return model.model_bytes
+
+    total = 0
+    for value in model.state_dict().values():
+        # Dynamically quantized Linear layers store packed (weight, bias) tuples
+        tensors = value if isinstance(value, (tuple, list)) else (value,)
+        total += sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+    return total
+
+class ModelRegistry:
+    """Serves several embedding models from one process.
+
+    The default model is pinned: it is loaded by the startup path and never
+    unloaded. Other models are loaded on first use, each with its own
+    batcher, and the least recently used idle ones are unloaded whenever the
+    loaded weights exceed ``memory_budget`` bytes.
+    """
+
+    def __init__(self, memory_budget: int = MODEL_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.entries: Dict[str, RegisteredModel] = {}
+        self.loads = 0
+        self.unloads = 0
+
+    def register(
+        self,
+        name: str,
+        source: str,
+        info: Dict[str, Any],
+        pinned: bool = False,
+        projection_path: Optional[str] = None
+    ):
+        if projection_path is None and os.path.isdir(source):
+            projection_path = os.path.join(source, PCA_FILENAME)
+        projection = load_projection(projection_path)
+        if projection is not None:
+            logger.info(f"Loaded {len(projection['components'])}-component PCA projection for {name}")
+        self.entries[name] = RegisteredModel(
+            name=name,
+            source=source,
+            info=info,
+            pinned=pinned,
+            projection=projection,
+            cache_namespace=f"{name}\0{INFERENCE_BACKEND}\0{weights_fingerprint(source)}"
+        )
+
+    def attach(self, name: str, loaded_model, model_batcher: EmbeddingBatcher):
+        """Record a model that was loaded outside the registry"""
+        entry = self.entries[name]
+        model_batcher.model = loaded_model
+        entry.model = loaded_model
+        entry.batcher = model_batcher
+        entry.memory_bytes = estimate_model_bytes(loaded_model)
+        entry.last_used = time.monotonic()
+
+    @asynccontextmanager
+    async def use(self, name: Optional[str] = None):
+        """Yield a loaded model entry, loading it first if needed"""
+        entry = self.entries.get(name or MODEL_NAME)
+        if entry is None:
+            raise UnknownModelError(
+                f"Unknown model '{name}', available: {', '.join(self.entries)}"
+            )
+
+        entry.active += 1
+        try:
+            if entry.model is None:
+                if entry.pinned:
+                    raise RuntimeError(f"Model {entry.name} is not loaded yet")
+                await self._load(entry)
+            entry.last_used = time.monotonic()
+            yield entry
+        finally:
+            entry.active -= 1
+
+    async def _load(self, entry: RegisteredModel):
+        if entry.lock is None:
+            entry.lock = asyncio.Lock()
+
+        async with entry.lock:
+            # Another request may have finished loading while we waited
+            if entry.model is not None:
+                return
+
+            logger.info(f"Loading model {entry.name} on demand from {entry.source}")
+            started = time.perf_counter()
+            loaded = await asyncio.get_running_loop().run_in_executor(None, load_model, entry.source)
+            model_batcher = EmbeddingBatcher(model=loaded, name=entry.name)
+            model_batcher.start()
+            entry.model = loaded
+            entry.batcher = model_batcher
+            entry.memory_bytes = estimate_model_bytes(loaded)
+            self.loads += 1
+            logger.info(
+                f"Loaded {entry.name} ({entry.memory_bytes / 1024**2:.0f} MB) "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+
+        await self._enforce_budget(keep=entry)
+
+    async def _enforce_budget(self, keep: RegisteredModel):
+        candidates = sorted(
+            (e for e in self.entries.values() if e.model is not None and not e.pinned and e is not keep),
+            key=lambda e: e.last_used
+        )
+        for entry in candidates:
+            if self.loaded_bytes() <= self.memory_budget:
+                break
+            # Models serving a request right now stay loaded
+            if entry.active or entry.batcher.queued_texts:
+                continue
+            await self._unload(entry)
+
+        if self.loaded_bytes() > self.memory_budget:
+            logger.warning(
+                f"Loaded models use {self.loaded_bytes() / 1024**2:.0f} MB, "
+                f"over the {self.memory_budget / 1024**2:.0f} MB budget"
+            )
+
+    async def _unload(self, entry: RegisteredModel):
+        logger.info(f"Unloading {entry.name} to stay within the model memory budget")
+        model_batcher = entry.batcher
+        entry.model = None
+        entry.batcher = None
+        entry.memory_bytes = 0
+        await model_batcher.stop()
+        self.unloads += 1
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    async def stop(self):
+        for entry in self.entries.values():
+            if entry.batcher is not None and not entry.pinned:
+                await entry.batcher.stop()
+
+    def loaded_bytes(self) -> int:
+        return sum(entry.memory_bytes for entry in self.entries.values())
+
+    def describe(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "name": entry.name,
+                **entry.info,
+                "loaded": entry.model is not None,
+                "pinned": entry.pinned,
+                "memory_mb": round(entry.memory_bytes / 1024**2, 1),
+                "queued_texts": entry.batcher.queued_texts if entry.batcher is not None else 0,
+                "pca_components": len(entry.projection["components"]) if entry.projection is not None else 0,
+            }
+            for entry in self.entries.values()
+        ]
+
+registry = ModelRegistry()
+for _name, _info in AVAILABLE_MODELS.items():
+    registry.register(
+        _name,
+        MODEL_SOURCES.get(_name) or (MODEL_PATH if _name == MODEL_NAME else None) or _name,
+        _info,
+        pinned=_name == MODEL_NAME,
+        projection_path=PCA_PATH if _name == MODEL_NAME else None
+    )
+
+def output_projection(
+    model_name: Optional[str],
+    output_dim: int,
+    reduction: str
+) -> Optional[Dict[str, np.ndarray]]:
+    """Check an output_dim request against a model, returning its PCA projection if one is needed"""
+    entry = registry.entries.get(model_name or MODEL_NAME)
+    if entry is None:
+        raise UnknownModelError(f"Unknown model '{model_name}', available: {', '.join(registry.entries)}")
+
+    dimensions = entry.info["dimensions"]
+    if output_dim > dimensions:
+        raise ValueError(f"output_dim {output_dim} exceeds the {dimensions} dimensions of {entry.name}")
+    if reduction == "truncate":
+        return None
+
+    if entry.projection is None:
+        raise ValueError(f"No PCA projection is stored for {entry.name}")
+    components = len(entry.projection["components"])
+    if output_dim > components:
+        raise ValueError(f"The PCA projection for {entry.name} has only {components} components")
+    return entry.projection
+
+class EmbeddingCache:
+    """Content-addressed embedding cache.
+
+    Entries are keyed on a hash of (model namespace, normalize flag,
+    prefixed text); the namespace covers the model name, inference backend
+    and weights, so switching either never serves stale vectors. The
+    in-memory tier is an LRU bounded by the total size of the stored
+    vectors; the optional SQLite tier survives restarts and promotes
+    entries back into memory on a hit. The SQLite connection belongs to a
+    thread of its own: lookups are awaited on it, and inserts queue up and
+    are committed in batches behind the request, so the event loop never
+    waits on disk.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, path: Optional[str] = CACHE_PATH):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.current_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk: Optional[ThreadPoolExecutor] = None
+        self._pending: List[tuple] = []
+        self._pending_lock = threading.Lock()
+
+    def open(self):
+        if self.path:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+            self._disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache")
+
+    def close(self):
+        # Shutting the thread down waits for queued writes to commit
+        if self._disk is not None:
+            self._disk.shutdown(wait=True)
+            self._disk = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def key(namespace: str, normalize: bool, text: Union[str, tuple]) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{namespace}\0{int(normalize)}\0".encode("utf-8"))
+        if isinstance(text, str):
+            digest.update(text.encode("utf-8"))
+        else:
+            # Pre-tokenized input
+            digest.update(b"\0ids\0")
+            digest.update(np.asarray(text, dtype=np.int32).tobytes())
+        return digest.hexdigest()
+
+    async def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up keys in memory, then on disk; misses come back as None"""
+        found: List[Optional[np.ndarray]] = [None] * len(keys)
+        disk_lookups = []
+
+        for i, key in enumerate(keys):
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                found[i] = vector
+            else:
+                disk_lookups.append(i)
+
+        if disk_lookups and self._db is not None:
+            rows = await asyncio.get_running_loop().run_in_executor(
+                self._disk, self._read_disk, list({keys[i] for i in disk_lookups})
+            )
+            for i in disk_lookups:
+                blob = rows.get(keys[i])
+                if blob is not None:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(keys[i], vector)
+                    self.disk_hits += 1
+                    found[i] = vector
+
+        self.misses += sum(1 for vector in found if vector is None)
+        return found
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        for key, vector in zip(keys, vectors):
+            self._remember(key, vector.copy())
+
+        if self._db is not None:
+            with self._pending_lock:
+                idle = not self._pending
+                self._pending.extend((key, vector.tobytes()) for key, vector in zip(keys, vectors))
+            # A flush already queued will pick these rows up too
+            if idle:
+                self._disk.submit(self._write_disk)
+
+    def _read_disk(self, keys: List[str]) -> Dict[str, bytes]:
+        rows = {}
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows.update(self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall())
+        return rows
+
+    def _write_disk(self):
+        with self._pending_lock:
+            rows, self._pending = self._pending, []
+        try:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to write {len(rows)} cached embeddings to {self.path}: {e}")
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if vector.nbytes > self.max_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.current_bytes -= previous.nbytes
+        self._entries[key] = vector
+        self.current_bytes += vector.nbytes
+
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "persistent": self._db is not None,
+        }
+
+cache = EmbeddingCache()
+passage_cache = EmbeddingCache(PASSAGE_CACHE_MAX_BYTES)
+
+def deduplicate(items: List[Union[str, tuple]]) -> tuple:
+    """Collapse identical inputs, returning (unique inputs, index into them for every input).
+
+    Surrounding whitespace is ignored, as the tokenizer strips it anyway.
+    """
+    positions: Dict[Union[str, tuple], int] = {}
+    inverse = [
+        positions.setdefault(item.strip() if isinstance(item, str) else item, len(positions))
+        for item in items
+    ]
+    return list(positions), np.array(inverse, dtype=np.int64)
+
+class SingleFlight:
+    """Shares embeddings of identical inputs that are in flight at the same time.
+
+    The first request for an input submits it to the model's batcher in a
+    task of its own; concurrent requests for the same model and input await
+    that task instead of encoding another copy. The task is shielded, so a
+    caller that disconnects does not cancel the work others are waiting on.
+    Shared work runs in its first requester's lane and under its deadline,
+    so a request only joins work in its own lane or a higher one; an
+    interactive request never waits behind a bulk submission. A joiner whose
+    own deadline has not passed resubmits if the owner's does.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[tuple, tuple] = {}
+
+    async def encode(self, entry: RegisteredModel, texts: List[Union[str, tuple]]) -> np.ndarray:
+        """Unnormalized embeddings for distinct texts, joining identical ones already in flight"""
+        lane = request_lane.get()
+        joinable = LANES[:LANES.index(lane) + 1]
+        rows: List[Optional[tuple]] = [None] * len(texts)
+        fresh = []
+        for i, text in enumerate(texts):
+            for other in joinable:
+                shared = self._inflight.get((entry.name, other, text))
+                if shared is not None:
+                    break
+            if shared is not None:
+                rows[i] = shared
+            else:
+                fresh.append(i)
+
+        joined = len(texts) - len(fresh)
+        if joined:
+            DEDUPLICATED_TOTAL.labels("inflight").inc(joined)
+
+        if fresh:
+            task = asyncio.ensure_future(entry.batcher.encode([texts[i] for i in fresh]))
+            keys = [(entry.name, lane, texts[i]) for i in fresh]
+            for row, (i, key) in enumerate(zip(fresh, keys)):
+                rows[i] = self._inflight[key] = (task, row)
+            task.add_done_callback(lambda done, keys=keys: self._finish(done, keys))
+
+        tasks = list({id(task): task for task, _ in rows}.values())
+        try:
+            results = await asyncio.gather(*(asyncio.shield(task) for task in tasks))
+        except DeadlineExceededError:
+            # A joined task ran out of its owner's time; retry unless ours is up too
+            if deadline_passed() or not joined:
+                raise
+            return await self.encode(entry, texts)
+        by_task = {id(task): result for task, result in zip(tasks, results)}
+
+        embeddings = np.empty((len(texts), results[0].shape[1]), dtype=np.float32)
+        for i, (task, row) in enumerate(rows):
+            embeddings[i] = by_task[id(task)][row]
+        return embeddings
+
+    def _finish(self, task: asyncio.Future, keys: List[tuple]):
+        for key in keys:
+            if self._inflight.get(key, (None,))[0] is task:
+                del self._inflight[key]
+        # Mark failures as retrieved when every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+single_flight = SingleFlight()
+
+async def embed_texts(
+    processed_texts: List[Union[str, tuple]],
+    normalize: bool,
+    model_name: Optional[str] = None,
+    store: Optional[EmbeddingCache] = None
+) -> np.ndarray:
+    """Embed prefixed texts with a registered model, serving what it can from the cache.
+
+    Duplicates within the call are embedded once and expanded afterwards.
+    Cache misses go to that model's shared batcher as a single submission,
+    except for texts another request is already encoding, which are shared.
+    Tuples of token ids may stand in for texts. ``store`` replaces the
+    shared embedding cache.
+    """
+    store = store or cache
+    texts, inverse = deduplicate(processed_texts)
+    if len(texts) < len(processed_texts):
+        DEDUPLICATED_TOTAL.labels("request").inc(len(processed_texts) - len(texts))
+
+    async with registry.use(model_name) as entry:
+        if store.max_bytes <= 0:
+            embeddings = await single_flight.encode(entry, texts)
+            if normalize:
+                with STAGE_SECONDS.labels("normalization").time():
+                    embeddings = normalize_rows(embeddings)
+            return embeddings[inverse]
+
+        keys = [EmbeddingCache.key(entry.cache_namespace, normalize, text) for text in texts]
+        cached = await store.get_many(keys)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+
+        if not missing:
+            return np.stack(cached)[inverse]
+
+        computed = await single_flight.encode(entry, [texts[i] for i in missing])
+    if normalize:
+        with STAGE_SECONDS.labels("normalization").time():
+            computed = normalize_rows(computed)
+    computed = computed.astype(np.float32, copy=False)
+    store.put_many([keys[i] for i in missing], computed)
+
+    embeddings = np.empty((len(texts), computed.shape[1]), dtype=np.float32)
+    for row, i in enumerate(missing):
+        embeddings[i] = computed[row]
+    for i, vector in enumerate(cached):
+        if vector is not None:
+            embeddings[i] = vector
+    return embeddings[inverse]
+
+async def embed_token_ids(
+    token_ids: List[List[int]],
+    normalize: bool,
+    model_name: Optional[str] = None
+) -> np.ndarray:
+    """Embed pre-tokenized inputs, checking them against the model's tokenizer first"""
+    async with registry.use(model_name) as entry:
+        max_length = entry.model.get_max_seq_length()
+        vocab_size = len(entry.model.tokenizer)
+        for i, ids in enumerate(token_ids):
+            if not ids:
+                raise ValueError(f"token_ids[{i}] is empty")
+            if len(ids) > max_length:
+                raise ValueError(f"token_ids[{i}] has {len(ids)} tokens, the model accepts at most {max_length}")
+            if min(ids) < 0 or max(ids) >= vocab_size:
+                raise ValueError(f"token_ids[{i}] contains ids outside the {vocab_size}-token vocabulary")
+
+        return await embed_texts([tuple(ids) for ids in token_ids], normalize, entry.name)
+
+async def embed_in_slices(
+    texts: List[str],
+    normalize: bool,
+    model_name: Optional[str] = None
+) -> np.ndarray:
+    """Embed a long text list in stream-sized slices, retrying slices a full queue turns away
+
+    No single submission exceeds what a lane can admit, so large requests
+    are throttled by the queue instead of rejected outright.
+    """
+    slots = asyncio.Semaphore(STREAM_MAX_INFLIGHT_BATCHES)
+
+    async def embed_slice(start: int) -> np.ndarray:
+        async with slots:
+            while True:
+                try:
+                    return await embed_texts(texts[start:start + STREAM_BATCH_SIZE], normalize, model_name)
+                except QueueFullError:
+                    await asyncio.sleep(STREAM_RETRY_INTERVAL)
+
+    tasks = [asyncio.ensure_future(embed_slice(start)) for start in range(0, len(texts), STREAM_BATCH_SIZE)]
+    try:
+        return np.concatenate(await asyncio.gather(*tasks))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def rerank_neighbours(
+    queries: List[str],
+    corpus: List[str],
+    neighbours: List[List[Dict[str, Any]]],
+    top_k: int,
+    candidates: int,
+    budget_ms: float
+) -> tuple:
+    """Reorder each query's leading bi-encoder matches by cross-encoder score.
+
+    At most EMBEDDING_RERANK_MAX_PAIRS pairs are scored per request and
+    cached scores are reused. If the pairs are not scored within
+    ``budget_ms`` (or the request deadline, if sooner) the bi-encoder order
+    is returned instead. Returns (neighbours, whether they were reranked).
+    """
+    per_query = min(candidates, RERANK_MAX_PAIRS // len(queries))
+    if per_query < 1:
+        raise ValueError(f"Reranking {len(queries)} queries exceeds the budget of {RERANK_MAX_PAIRS} pairs")
+
+    scores: List[Dict[int, float]] = [{} for _ in queries]
+    pairs, slots, keys = [], [], []
+    for i, (query, row) in enumerate(zip(queries, neighbours)):
+        for match in row[:per_query]:
+            passage = corpus[match["index"]]
+            key = ScoreCache.key(RERANK_MODEL_NAME, query, passage)
+            cached = rerank_cache.get(key)
+            if cached is None:
+                pairs.append((query, passage))
+                slots.append((i, match["index"]))
+                keys.append(key)
+            else:
+                scores[i][match["index"]] = cached
+
+    if pairs:
+        budget_end = asyncio.get_running_loop().time() + budget_ms / 1000.0
+        deadline = request_deadline.get()
+        token = request_deadline.set(budget_end if deadline is None else min(deadline, budget_end))
+        try:
+            computed = await rerank_batcher.encode(pairs)
+        except (DeadlineExceededError, QueueFullError):
+            RERANK_FALLBACKS_TOTAL.inc()
+            return [row[:top_k] for row in neighbours], False
+        finally:
+            request_deadline.reset(token)
+        for (i, index), key, score in zip(slots, keys, computed.tolist()):
+            rerank_cache.put(key, score)
+            scores[i][index] = score
+
+    reranked = []
+    for i, row in enumerate(neighbours):
+        head = sorted(row[:per_query], key=lambda match: -scores[i][match["index"]])
+        head = [{**match, "rerank_score": scores[i][match["index"]]} for match in head]
+        reranked.append((head + row[per_query:])[:top_k])
+    return reranked, True
+
+def spherical_kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    iterations: int = 10,
+    seed: int = 0
+) -> np.ndarray:
+    """Fit unit-length centroids to normalized vectors, returning the centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_clusters)
+        filled = np.flatnonzero(counts)
+        # Sum each cluster's members in one pass over the sorted rows
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = normalize_rows(np.add.reduceat(vectors[order], starts, axis=0))
+
+    return centroids
+
+# Polish letters outside the reach of NFKD decomposition
+POLISH_FOLDING = str.maketrans({"ł": "l", "Ł": "L"})
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+# Inflectional endings after folding, longest first; stripping them conflates most case forms
+POLISH_SUFFIXES = sorted({
+    "owie", "ami", "ach", "ych", "ich", "ymi", "imi", "ego", "emu", "owa", "owe", "owy", "owi",
+    "ow", "om", "em", "ie", "ia", "iu", "ej", "a", "e", "i", "o", "u", "y",
+}, key=len, reverse=True)
+STEM_MIN_LENGTH = 3
+
+def fold_diacritics(text: str) -> str:
+    """Lowercase and strip diacritics, so "Żelazo" and "zelazo" match"""
+    decomposed = unicodedata.normalize("NFKD", text.translate(POLISH_FOLDING).lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def stem_token(token: str) -> str:
+    """Strip one Polish inflectional ending; tokens with digits (doses, B12) are kept whole"""
+    if any(char.isdigit() for char in token):
+        return token
+    for suffix in POLISH_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= STEM_MIN_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+def analyze_text(text: str) -> List[str]:
+    """BM25 terms of a text: folded, stemmed words, with "500mg" also indexed as "500" and "mg" """
+    terms = []
+    for token in TOKEN_PATTERN.findall(fold_diacritics(text)):
+        terms.append(stem_token(token))
+        parts = re.findall(r"\d+|[^\W\d_]+", token)
+        if len(parts) > 1:
+            terms.extend(stem_token(part) for part in parts)
+    return terms
+
+class LexicalIndex:
+    """BM25 inverted index over document texts.
+
+    Postings map each term to ``{slot: term frequency}``. Documents get a
+    slot that is reused after deletion, so document lengths stay in one
+    dense array and a query is scored with one vectorized update per term.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self._slots: Dict[str, int] = {}
+        self._doc_ids: List[Optional[str]] = []
+        self._terms: List[Optional[Dict[str, int]]] = []
+        self._lengths = np.zeros(1024, dtype=np.float32)
+        self._free: List[int] = []
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def add(self, doc_id: str, text: str):
+        self.remove(doc_id)
+        terms: Dict[str, int] = {}
+        for term in analyze_text(text):
+            terms[term] = terms.get(term, 0) + 1
+
+        if self._free:
+            slot = self._free.pop()
+            self._doc_ids[slot] = doc_id
+            self._terms[slot] = terms
+        else:
+            slot = len(self._doc_ids)
+            self._doc_ids.append(doc_id)
+            self._terms.append(terms)
+            if slot == len(self._lengths):
+                self._lengths = np.concatenate([self._lengths, np.zeros_like(self._lengths)])
+
+        self._slots[doc_id] = slot
+        length = sum(terms.values())
+        self._lengths[slot] = length
+        self._total_length += length
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[slot] = frequency
+
+    def remove(self, doc_id: str):
+        slot = self._slots.pop(doc_id, None)
+        if slot is None:
+            return
+        for term in self._terms[slot]:
+            postings = self.postings[term]
+            del postings[slot]
+            if not postings:
+                del self.postings[term]
+        self._total_length -= int(self._lengths[slot])
+        self._lengths[slot] = 0
+        self._doc_ids[slot] = None
+        self._terms[slot] = None
+        self._free.append(slot)
+
+    def search(self, text: str, k: int) -> List[tuple]:
+        """Up to k ``(doc id, BM25 score)`` pairs sharing a term with the text, best first"""
+        if not self._slots:
+            return []
+
+        n_docs = len(self._slots)
+        lengths = self._lengths[:len(self._doc_ids)]
+        length_norm = self.k1 * (1 - self.b + self.b * lengths / (self._total_length / n_docs or 1.0))
+        scores = np.zeros(len(self._doc_ids), dtype=np.float32)
+        for term in set(analyze_text(text)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            slots = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+            frequencies = np.fromiter(postings.values(), dtype=np.float32, count=len(postings))
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            scores[slots] += idf * frequencies * (self.k1 + 1) / (frequencies + length_norm[slots])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self._doc_ids[slot], float(scores[slot])) for slot in matched]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"documents": len(self._slots), "terms": len(self.postings)}
+
+def fuse_rankings(
+    dense: np.ndarray,
+    lexical: np.ndarray,
+    fusion: str = "rrf",
+    alpha: float = 0.5
+) -> np.ndarray:
+    """Combine dense and BM25 scores of the same candidates; a BM25 score of 0 means no lexical match"""
+    if fusion == "weighted":
+        top = lexical.max() if len(lexical) else 0.0
+        return alpha * dense + (1 - alpha) * (lexical / top if top > 0 else lexical)
+
+    fused = np.zeros(len(dense), dtype=np.float64)
+    fused[np.argsort(-dense, kind="stable")] = 1.0 / (RRF_K + np.arange(1, len(dense) + 1))
+    lexical_ranks = np.empty(len(lexical), dtype=np.float64)
+    lexical_ranks[np.argsort(-lexical, kind="stable")] = np.arange(1, len(lexical) + 1)
+    fused += np.where(lexical > 0, 1.0 / (RRF_K + lexical_ranks), 0.0)
+    return fused
+
+def minibatch_kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    batch_size: int = 1024,
+    iterations: int = 100,
+    seed: int = 0
+) -> np.ndarray:
+    """Fit unit-length centroids with mini-batch spherical k-means, returning the centroids
+
+    Each step assigns a random batch and moves every hit centroid towards
+    the mean of its batch members at a rate of 1 / (rows it has seen), so a
+    step costs one batch x centroids product whatever the corpus size.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    seen = np.zeros(n_clusters)
+
+    for _ in range(iterations):
+        batch = vectors[rng.choice(len(vectors), min(batch_size, len(vectors)), replace=False)]
+        assignments = np.argmax(batch @ centroids.T, axis=1)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, batch)
+
+        hit = np.flatnonzero(counts)
+        seen[hit] += counts[hit]
+        rate = (counts[hit] / seen[hit])[:, None]
+        centroids[hit] = normalize_rows((1 - rate) * centroids[hit] + rate * sums[hit] / counts[hit][:, None])
+
+    return centroids
+
+def assign_clusters(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    max_block_bytes: int = KNN_GRAPH_BLOCK_BYTES
+) -> np.ndarray:
+    """Nearest centroid of every row, scored in blocks of rows whose score tile fits ``max_block_bytes``"""
+    block = max(1, max_block_bytes // (4 * len(centroids)))
+    return np.concatenate([
+        np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), block)
+    ])
+
+def snapshot_checksum(vectors: np.ndarray, block: int = 65536) -> str:
+    """BLAKE2b digest of a float32 matrix, hashed a block of rows at a time so memory maps stay lazy"""
+    digest = hashlib.blake2b(digest_size=16)
+    for start in range(0, len(vectors), block):
+        digest.update(np.ascontiguousarray(vectors[start:start + block], dtype="<f4").tobytes())
+    return digest.hexdigest()
+
+
+class VectorIndex:
+    """In-process corpus index over normalized passage embeddings.
+
+    Vectors live in one contiguous float32 matrix (grown by doubling) so exact
+    search is a single matrix-vector product. Deletes move the last row into
+    the freed slot to keep the matrix dense. Approximate search uses an IVF
+    layout (spherical k-means centroids plus per-centroid row lists) that is
+    rebuilt lazily after the index changes.
+
+    Document texts are also kept in a BM25 ``LexicalIndex`` for lexical and
+    hybrid search; it is rebuilt from the payloads when a snapshot loads.
+
+    Snapshots are a ``vectors.npy`` matrix and an ``ids.json`` sidecar;
+    loading maps the matrix copy-on-write, so untouched pages are shared with
+    the OS page cache. The sidecar is written last and records the model and
+    a checksum of the matrix, so a crash between the two writes
+    or a snapshot from another model is refused on load rather than served.
+
+    Whole-index work (IVF rebuilds, snapshots) runs on a worker thread
+    holding ``write_lock``; callers on the event loop take the same lock
+    around ``upsert`` and ``delete`` so they never interleave with it.
+    """
+
+    def __init__(self, path: Optional[str] = INDEX_PATH):
+        self.path = path
+        self.ids: List[str] = []
+        self.payloads: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        self._ivf_stale = True
+        self.lexical = LexicalIndex()
+        self.write_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dimensions(self) -> Optional[int]:
+        return None if self._vectors is None else self._vectors.shape[1]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:len(self.ids)]
+
+    def upsert(self, ids: List[str], vectors: np.ndarray, payloads: List[Dict[str, Any]]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._vectors is None:
+            self._vectors = np.empty((max(len(ids), 1024), vectors.shape[1]), dtype=np.float32)
+        elif vectors.shape[1] != self._vectors.shape[1]:
+            raise ValueError(
+                f"Vector dimension {vectors.shape[1]} does not match index dimension {self._vectors.shape[1]}"
+            )
+
+        for doc_id, vector, payload in zip(ids, vectors, payloads):
+            row = self._rows.get(doc_id)
+            if row is None:
+                row = len(self.ids)
+                if row == len(self._vectors):
+                    grown = np.empty((len(self._vectors) * 2, self._vectors.shape[1]), dtype=np.float32)
+                    grown[:row] = self._vectors[:row]
+                    self._vectors = grown
+                self.ids.append(doc_id)
+                self.payloads.append(payload)
+                self._rows[doc_id] = row
+            else:
+                self.payloads[row] = payload
+            self._vectors[row] = vector
+            self.lexical.add(doc_id, payload.get("text", ""))
+
+        self._ivf_stale = True
+
+    def get(self, ids: List[str]) -> np.ndarray:
+        """Stored vectors for ``ids``, in order"""
+        unknown = [doc_id for doc_id in ids if doc_id not in self._rows]
+        if unknown:
+            raise ValueError(f"Unknown document ids: {', '.join(unknown[:10])}")
+        return self._vectors[[self._rows[doc_id] for doc_id in ids]]
+
+    def delete(self, ids: List[str]) -> int:
+        deleted = 0
+        for doc_id in ids:
+            row = self._rows.pop(doc_id, None)
+            if row is None:
+                continue
+            last = len(self.ids) - 1
+            if row != last:
+                self._vectors[row] = self._vectors[last]
+                self.ids[row] = self.ids[last]
+                self.payloads[row] = self.payloads[last]
+                self._rows[self.ids[row]] = row
+            self.ids.pop()
+            self.payloads.pop()
+            self.lexical.remove(doc_id)
+            deleted += 1
+
+        if deleted:
+            self._ivf_stale = True
+        return deleted
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        approximate: bool = False,
+        nprobe: int = INDEX_NPROBE
+    ) -> List[List[Dict[str, Any]]]:
+        """Top-k documents per query row as ``{"id", "score", ...payload}``"""
+        if not self.ids:
+            return [[] for _ in range(len(queries))]
+
+        if not approximate or len(self.ids) < INDEX_IVF_MIN_SIZE:
+            matches = top_k_neighbours(queries @ self.vectors.T, k)
+        else:
+            matches = [self._search_ivf(query, k, nprobe) for query in queries]
+
+        return [
+            [{"id": self.ids[match["index"]], "score": match["score"], **self.payloads[match["index"]]}
+             for match in row]
+            for row in matches
+        ]
+
+    def search_lexical(self, texts: List[str], k: int) -> List[List[Dict[str, Any]]]:
+        """Top-k documents per query text by BM25 alone"""
+        return [
+            [{"id": doc_id, "score": score, **self.payloads[self._rows[doc_id]]}
+             for doc_id, score in self.lexical.search(text, k)]
+            for text in texts
+        ]
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+    def search_hybrid(
+        self,
+        texts: List[str],
+        queries: np.ndarray,
+        k: int,
+        candidates: int = HYBRID_CANDIDATES,
+        fusion: str = "rrf",
+        alpha: float = 0.5
+    ) -> List[List[Dict[str, Any]]]:
+        """Top-k documents per query from BM25 candidates rescored with their stored vectors
 
-# Global model variable
-model = None
-device = "cuda" if torch.cuda.is_available() else "cpu"
+        Only the candidates are scored densely. When fewer than k documents
+        share a term with the query, exact dense search fills the gap.
+        """
+        results = []
+        for text, query in zip(texts, queries):
+            lexical = self.lexical.search(text, max(candidates, k))
+            rows = [self._rows[doc_id] for doc_id, _ in lexical]
+            bm25 = [score for _, score in lexical]
+            if len(rows) < k and self.ids:
+                seen = set(rows)
+                fill = top_k_neighbours((self.vectors @ query)[None, :], k + len(rows))[0]
+                fill = [match["index"] for match in fill if match["index"] not in seen][:k - len(rows)]
+                rows.extend(fill)
+                bm25.extend([0.0] * len(fill))
+            if not rows:
+                results.append([])
+                continue
 
-class EmbeddingRequest(BaseModel):
-    texts: List[str] = Field(..., min_items=1, max_items=100)
-    normalize: bool = True
-    model_name: Optional[str] = None
+            rows = np.array(rows, dtype=np.int64)
+            bm25 = np.array(bm25, dtype=np.float32)
+            dense = self._vectors[rows] @ query
+            fused = fuse_rankings(dense, bm25, fusion, alpha)
+            order = np.argsort(-fused, kind="stable")[:k]
+            results.append([
+                {
+                    "id": self.ids[rows[i]],
+                    "score": float(fused[i]),
+                    "dense_score": float(dense[i]),
+                    "bm25_score": float(bm25[i]),
+                    **self.payloads[rows[i]]
+                }
+                for i in order
+            ])
+        return results
 
-class EmbeddingResponse(BaseModel):
-    embeddings: List[List[float]]
-    model: str
-    processing_time: float
-    device: str
+    def _search_ivf(self, query: np.ndarray, k: int, nprobe: int) -> List[Dict[str, Any]]:
+        if self._ivf_stale:
+            self._build_ivf()
 
-class HealthResponse(BaseModel):
-    status: str
-    model: str
-    device: str
-    memory_usage: Dict[str, Any]
+        probes = top_k_neighbours((query @ self._centroids.T)[None, :], nprobe)[0]
+        candidates = np.concatenate([self._lists[probe["index"]] for probe in probes])
+        if len(candidates) == 0:
+            return []
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Application lifespan manager for model loading"""
-    global model
+        matches = top_k_neighbours((self.vectors[candidates] @ query)[None, :], k)[0]
+        return [{"index": int(candidates[match["index"]]), "score": match["score"]} for match in matches]
+
+    async def run_locked(self, fn, *args):
+        """Run ``fn`` on a worker thread with writers held off until it returns
+
+        The lock is released by the thread's completion, not the caller, so
+        a cancelled request cannot let writes into a half-read index.
+        """
+        async def locked():
+            async with self.write_lock:
+                return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+        return await asyncio.shield(asyncio.ensure_future(locked()))
+
+    @property
+    def ivf_ready(self) -> bool:
+        return not self._ivf_stale
+
+    async def refresh_ivf(self):
+        """Rebuild a stale IVF layout off the event loop before approximate search"""
+        def rebuild():
+            # Another search may have rebuilt it while this one waited for the lock
+            if self._ivf_stale:
+                self._build_ivf()
+
+        if self._ivf_stale and len(self.ids) >= INDEX_IVF_MIN_SIZE:
+            await self.run_locked(rebuild)
+
+    def _build_ivf(self):
+        vectors = self.vectors
+        n_lists = max(1, int(np.sqrt(len(vectors))))
+        # Train on a sample; k-means quality saturates long before the full corpus
+        rng = np.random.default_rng(0)
+        sample_size = min(len(vectors), n_lists * 256)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        self._centroids = spherical_kmeans(sample, n_lists)
+
+        assignments = np.argmax(vectors @ self._centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.cumsum(np.bincount(assignments, minlength=n_lists))[:-1]
+        self._lists = np.split(order, bounds)
+        self._ivf_stale = False
+        logger.info(f"Built IVF index with {n_lists} lists over {len(vectors)} vectors")
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.path
+        if not path:
+            raise ValueError("No index path configured")
+        os.makedirs(path, exist_ok=True)
+
+        # Each file is replaced whole; ids.json goes last and carries the checksum
+        # of the matrix, so load() notices a crash between the two replaces
+        vectors = self.vectors if self._vectors is not None else np.empty((0, 0), dtype=np.float32)
+        vectors_tmp = os.path.join(path, "vectors.tmp.npy")
+        ids_tmp = os.path.join(path, "ids.tmp.json")
+        np.save(vectors_tmp, vectors)
+        with open(ids_tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "model": MODEL_NAME,
+                "checksum": snapshot_checksum(vectors),
+                "ids": self.ids,
+                "payloads": self.payloads,
+            }, f, ensure_ascii=False)
+        os.replace(vectors_tmp, os.path.join(path, "vectors.npy"))
+        os.replace(ids_tmp, os.path.join(path, "ids.json"))
+
+    def load(self, path: Optional[str] = None, model_name: Optional[str] = MODEL_NAME) -> bool:
+        """Replace the index with a snapshot, returning False when there is none
+
+        Raises ValueError for a snapshot embedded with a model other than
+        ``model_name`` (None accepts any) or whose matrix does not match its
+        ``ids.json``.
+        """
+        path = path or self.path
+        vectors_path = os.path.join(path or "", "vectors.npy")
+        ids_path = os.path.join(path or "", "ids.json")
+        if not path or not os.path.exists(vectors_path) or not os.path.exists(ids_path):
+            return False
+
+        with open(ids_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if model_name and meta.get("model") and meta["model"] != model_name:
+            raise ValueError(f"Index snapshot in {path} was embedded with {meta['model']}, not {model_name}")
+        vectors = np.load(vectors_path, mmap_mode="c")
+        if len(vectors) != len(meta["ids"]):
+            raise ValueError(f"Index snapshot in {path} is torn: {len(vectors)} vectors for {len(meta['ids'])} ids")
+        if "checksum" in meta and snapshot_checksum(vectors) != meta["checksum"]:
+            raise ValueError(f"Index snapshot in {path} is torn: vectors.npy does not match ids.json")
+
+        self.ids = meta["ids"]
+        self.payloads = meta["payloads"]
+        self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self._vectors = vectors if len(self.ids) else None
+        self._ivf_stale = True
+        self.lexical = LexicalIndex()
+        for doc_id, payload in zip(self.ids, self.payloads):
+            self.lexical.add(doc_id, payload.get("text", ""))
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self.ids),
+            "dimensions": self.dimensions,
+            "ivf_lists": len(self._lists) if self.ivf_ready else 0,
+            "lexical_terms": len(self.lexical.postings),
+            "path": self.path,
+        }
+
+vector_index = VectorIndex()
+
+def chunk_document(model, text: str, window: int, stride: int) -> List[tuple]:
+    """Split a text into token windows, returning (start char, end char, tokens) per chunk"""
+    encoded = model.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    offsets = encoded["offset_mapping"]
+    if not offsets:
+        return [(0, len(text), 0)]
+
+    chunks = []
+    for start in range(0, len(offsets), stride):
+        end = min(start + window, len(offsets))
+        chunks.append((offsets[start][0], offsets[end - 1][1], end - start))
+        if end == len(offsets):
+            break
+    return chunks
+
+async def embed_chunked(request: EmbeddingRequest) -> tuple:
+    """Embed long texts chunk by chunk, returning (embeddings, chunk map).
+
+    Every chunk of every text goes to the batcher in one submission. With
+    ``pooling`` set to ``mean`` or ``weighted`` (by chunk token count) the
+    chunk vectors are pooled back into one vector per text; with ``none``
+    each chunk keeps its own row and the chunk map records which text and
+    character span it came from.
+    """
+    options = request.chunking
+    async with registry.use(request.model_name) as entry:
+        max_window = entry.model.get_max_seq_length() - CHUNK_RESERVED_TOKENS
+        window = options.window or max_window
+        if window > max_window:
+            raise ValueError(
+                f"window must not exceed {max_window} tokens for {entry.name}, or every chunk would be truncated"
+            )
+        stride = options.stride or window
+        if stride > window:
+            raise ValueError("stride must not exceed window, or text between chunks would be skipped")
+
+        def plan():
+            planned = []
+            for text_index, text in enumerate(request.texts):
+                prefix, body, body_start = split_prefix(text)
+                for start, end, tokens in chunk_document(entry.model, body, window, stride):
+                    planned.append((text_index, prefix + body[start:end], body_start + start, body_start + end, tokens))
+            return planned
+
+        # Tokenizing long documents is too slow to do on the event loop
+        planned = await asyncio.get_running_loop().run_in_executor(None, plan)
+        if len(planned) > MAX_CHUNKS_PER_REQUEST:
+            raise ValueError(f"Request produces {len(planned)} chunks, limit is {MAX_CHUNKS_PER_REQUEST}")
+
+        pooled = options.pooling != "none"
+        vectors = await embed_texts(
+            [chunk[1] for chunk in planned], True if pooled else request.normalize, entry.name
+        )
+    chunk_map = [
+        {"text_index": text_index, "start": start, "end": end, "tokens": tokens}
+        for text_index, _, start, end, tokens in planned
+    ]
+    if not pooled:
+        return vectors, chunk_map
+
+    text_indices = np.array([chunk[0] for chunk in planned])
+    weights = np.ones(len(planned), dtype=np.float32)
+    if options.pooling == "weighted":
+        weights = np.array([max(chunk[4], 1) for chunk in planned], dtype=np.float32)
+
+    embeddings = np.zeros((len(request.texts), vectors.shape[1]), dtype=np.float32)
+    np.add.at(embeddings, text_indices, vectors * weights[:, None])
+    embeddings /= np.bincount(text_indices, weights=weights, minlength=len(request.texts))[:, None]
+    if request.normalize:
+        embeddings = normalize_rows(embeddings)
+    return embeddings, chunk_map
+
+def encode_embedding_response(
+    embeddings: np.ndarray,
+    request: EmbeddingRequest,
+    accept: Optional[str],
+    processing_time: float,
+    chunks: Optional[List[Dict[str, Any]]] = None
+) -> Response:
+    """Serialize embeddings according to the Accept header and request options.
+
+    Responses are built directly rather than through ``EmbeddingResponse`` so
+    the vectors never go through per-float pydantic validation. Per-chunk
+    results carry their chunk map in the JSON body, or as compact
+    ``[text_index, start, end]`` triples in ``X-Embedding-Chunks`` for the
+    binary formats.
+    """
+    accept = (accept or "").lower()
+    # Always little-endian on the wire, whatever the host byte order
+    array = np.ascontiguousarray(embeddings, dtype=np.dtype(request.dtype).newbyteorder("<"))
+    headers = {
+        "X-Embedding-Shape": ",".join(str(dim) for dim in array.shape),
+        "X-Embedding-Dtype": request.dtype,
+        "X-Model": request.model_name or MODEL_NAME,
+        "X-Processing-Time": f"{processing_time:.6f}",
+    }
+    extra = {}
+    if chunks is not None:
+        headers["X-Embedding-Chunks"] = json.dumps(
+            [[chunk["text_index"], chunk["start"], chunk["end"]] for chunk in chunks],
+            separators=(",", ":")
+        )
+        extra["chunks"] = chunks
+
+    if NPY_MEDIA_TYPE in accept:
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        return Response(content=buffer.getvalue(), media_type=NPY_MEDIA_TYPE, headers=headers)
+
+    if RAW_MEDIA_TYPE in accept:
+        return Response(content=array.tobytes(), media_type=RAW_MEDIA_TYPE, headers=headers)
+
+    if request.encoding_format == "base64":
+        return JSONResponse({
+            "embeddings": base64.b64encode(array.tobytes()).decode("ascii"),
+            "shape": list(array.shape),
+            "dtype": request.dtype,
+            "model": request.model_name or MODEL_NAME,
+            "processing_time": processing_time,
+            "device": device,
+            **extra
+        })
+
+    return JSONResponse({
+        "embeddings": embeddings.tolist(),
+        "model": request.model_name or MODEL_NAME,
+        "processing_time": processing_time,
+        "device": device,
+        **extra
+    })
+
+class BodyStreamingResponse(StreamingResponse):
+    """StreamingResponse that leaves ``receive`` to the endpoint.
+
+    Starlette's default watches ``receive`` for disconnects while streaming,
+    which would swallow request body chunks the endpoint is still reading.
+    Disconnects surface through ``Request.stream()`` instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+def parse_stream_record(line: bytes, line_number: int) -> Dict[str, Any]:
+    """Parse one NDJSON input line into an ``{"id", "text"}`` record"""
+    record = json.loads(line)
+    if not isinstance(record, dict) or not isinstance(record.get("text"), str):
+        raise ValueError("expected an object with a string 'text' field")
+    return {"id": record.get("id", line_number), "text": record["text"]}
 
-    logger.info("Loading embedding model...")
+async def stream_embeddings(
+    request: Request,
+    normalize: bool,
+    model_name: Optional[str],
+    encoding_format: str
+):
+    """Embed an NDJSON upload batch by batch, yielding NDJSON results in input order.
 
-    # Load the multilingual model optimized for Polish
-    model_name = "intfloat/multilingual-e5-large"
+    A reader task parses the body into batches of ``STREAM_BATCH_SIZE``
+    records and starts embedding each one. At most
+    ``STREAM_MAX_INFLIGHT_BATCHES`` batches wait to be written out; once that
+    many are pending the reader stops pulling the body, so memory stays
+    bounded and a slow model or client pushes back on the uploader. Batches
+    turned away by a full inference queue are retried rather than failed.
+    """
+    pending: asyncio.Queue = asyncio.Queue(maxsize=STREAM_MAX_INFLIGHT_BATCHES)
 
+    async def embed_batch(records: List[Dict[str, Any]]) -> np.ndarray:
+        texts = prefix_texts([record["text"] for record in records])
+        while True:
+            try:
+                return await embed_texts(texts, normalize, model_name)
+            except QueueFullError:
+                await asyncio.sleep(STREAM_RETRY_INTERVAL)
+
+    async def flush(records: List[Dict[str, Any]]):
+        await pending.put((records, asyncio.create_task(embed_batch(records))))
+
+    async def read_body():
+        buffer = b""
+        batch: List[Dict[str, Any]] = []
+        line_number = 0
+        try:
+            async for chunk in request.stream():
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                if len(buffer) > STREAM_MAX_LINE_BYTES:
+                    raise ValueError(f"Line {line_number + len(lines) + 1} exceeds {STREAM_MAX_LINE_BYTES} bytes")
+
+                for line in lines:
+                    line_number += 1
+                    if not line.strip():
+                        continue
+                    try:
+                        batch.append(parse_stream_record(line, line_number))
+                    except ValueError as e:
+                        # Report bad lines in place, after the records before them, and keep going
+                        if batch:
+                            await flush(batch)
+                            batch = []
+                        await pending.put(([{"line": line_number, "error": str(e)}], None))
+                        continue
+                    if len(batch) >= STREAM_BATCH_SIZE:
+                        await flush(batch)
+                        batch = []
+
+            if buffer.strip():
+                line_number += 1
+                try:
+                    batch.append(parse_stream_record(buffer, line_number))
+                except ValueError as e:
+                    if batch:
+                        await flush(batch)
+                        batch = []
+                    await pending.put(([{"line": line_number, "error": str(e)}], None))
+            if batch:
+                await flush(batch)
+        except Exception as e:
+            await pending.put(([{"error": f"Stream aborted: {e}"}], None))
+        finally:
+            await pending.put(None)
+
+    reader = asyncio.create_task(read_body())
+    embedded = 0
     try:
-        model = SentenceTransformer(model_name, device=device)
-        logger.info(f"Model loaded successfully on {device}")
-        logger.info(f"Model max sequence length: {model.get_max_seq_length()}")
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+
+            records, task = item
+            if task is None:
+                yield "".join(json.dumps(record) + "\n" for record in records)
+                continue
+
+            try:
+                vectors = await task
+            except Exception as e:
+                logger.error(f"Error embedding stream batch: {e}")
+                yield "".join(json.dumps({"id": record["id"], "error": str(e)}) + "\n" for record in records)
+                continue
+
+            if encoding_format == "base64":
+                vectors = vectors.astype("<f4", copy=False)
+                lines = [
+                    {"id": record["id"], "embedding": base64.b64encode(vector.tobytes()).decode("ascii")}
+                    for record, vector in zip(records, vectors)
+                ]
+            else:
+                lines = [{"id": record["id"], "embedding": vector.tolist()} for record, vector in zip(records, vectors)]
+            embedded += len(records)
+            yield "".join(json.dumps(line) + "\n" for line in lines)
+
+        logger.info(f"Streamed {embedded} embeddings")
+    finally:
+        reader.cancel()
+        while not pending.empty():
+            item = pending.get_nowait()
+            if item is not None and item[1] is not None:
+                item[1].cancel()
+
+def active_batchers() -> List[EmbeddingBatcher]:
+    """Batchers of every loaded model, on-demand ones and the reranker included"""
+    batchers = [entry.batcher for entry in registry.entries.values() if entry.batcher is not None]
+    if rerank_batcher.model is not None:
+        batchers.append(rerank_batcher)
+    return batchers
+
+class ServiceStatsCollector:
+    """Exposes batcher, cache and runtime state at scrape time"""
+
+    def collect(self):
+        queued = GaugeMetricFamily("embedding_queued_texts", "Texts admitted and not yet embedded", labels=["model"])
+        busy = GaugeMetricFamily("embedding_busy_workers", "Inference workers running a batch", labels=["model"])
+        lanes = GaugeMetricFamily("embedding_lane_queued_texts", "Texts admitted and not yet embedded, per priority lane", labels=["model", "lane"])
+        padded = CounterMetricFamily("embedding_padded_tokens", "Tokens including padding run through the model", labels=["model"])
+        token_lookups = CounterMetricFamily("embedding_token_cache_lookups", "Tokenization cache lookups by result", labels=["model", "result"])
+        for model_batcher in active_batchers():
+            queue = model_batcher.stats()
+            name = model_batcher.name
+            queued.add_metric([name], queue["queued_texts"])
+            busy.add_metric([name], queue["busy_workers"])
+            for lane, lane_stats in queue["lanes"].items():
+                lanes.add_metric([name, lane], lane_stats["queued_texts"])
+            padded.add_metric([name], queue["padded_tokens"])
+            token_lookups.add_metric([name, "hit"], queue["token_cache"]["hits"])
+            token_lookups.add_metric([name, "miss"], queue["token_cache"]["misses"])
+        yield queued
+        yield busy
+        yield lanes
+        yield padded
+        yield token_lookups
+        rerank_stats = rerank_cache.stats()
+        rerank_lookups = CounterMetricFamily("embedding_rerank_cache_lookups", "Cross-encoder score cache lookups by result", labels=["result"])
+        rerank_lookups.add_metric(["hit"], rerank_stats["hits"])
+        rerank_lookups.add_metric(["miss"], rerank_stats["misses"])
+        yield rerank_lookups
+
+        cache_stats = cache.stats()
+        lookups = CounterMetricFamily("embedding_cache_lookups", "Embedding cache lookups by result", labels=["result"])
+        lookups.add_metric(["memory_hit"], cache_stats["hits"])
+        lookups.add_metric(["disk_hit"], cache_stats["disk_hits"])
+        lookups.add_metric(["miss"], cache_stats["misses"])
+        yield lookups
+        yield CounterMetricFamily("embedding_cache_evictions", "Entries evicted from the in-memory cache", value=cache_stats["evictions"])
+        yield GaugeMetricFamily("embedding_cache_bytes", "Bytes held by the in-memory cache", value=cache_stats["bytes"])
+
+        passage_stats = passage_cache.stats()
+        passage_lookups = CounterMetricFamily("embedding_passage_cache_lookups", "/rank passage cache lookups by result", labels=["result"])
+        passage_lookups.add_metric(["memory_hit"], passage_stats["hits"])
+        passage_lookups.add_metric(["disk_hit"], passage_stats["disk_hits"])
+        passage_lookups.add_metric(["miss"], passage_stats["misses"])
+        yield passage_lookups
+        yield GaugeMetricFamily("embedding_passage_cache_bytes", "Bytes held by the in-memory passage cache", value=passage_stats["bytes"])
+
+        memory = GaugeMetricFamily("embedding_model_memory_bytes", "Weight bytes per loaded model", labels=["model"])
+        for entry in registry.entries.values():
+            if entry.model is not None:
+                memory.add_metric([entry.name], entry.memory_bytes)
+        yield memory
 
-        # Warm up the model
-        _ = model.encode(["test"], convert_to_numpy=True)
-        logger.info("Model warmed up")
+        threads = GaugeMetricFamily("embedding_torch_threads", "Torch CPU thread pool sizes", labels=["pool"])
+        threads.add_metric(["intra_op"], torch.get_num_threads())
+        threads.add_metric(["inter_op"], torch.get_num_interop_threads())
+        yield threads
 
+REGISTRY.register(ServiceStatsCollector())
+
+def load_and_warm_up():
+    """Load the model, warm it up and only then publish it to request handlers"""
+    global model, device, model_state
+
+    logger.info(f"Loading embedding model from {MODEL_PATH or 'the hub'} with the {INFERENCE_BACKEND} backend...")
+
+    started = time.perf_counter()
+    if preloaded_model is not None:
+        # Copy-on-write pages shared with the launcher and the other workers
+        loaded = preloaded_model
+    else:
+        # Load the multilingual model optimized for Polish
+        loaded = load_model(MODEL_PATH or MODEL_NAME)
+    startup_timings["weight_load"] = time.perf_counter() - started
+    if INFERENCE_BACKEND != "torch":
+        device = "cpu"
+    logger.info(f"Model loaded successfully on {device} in {startup_timings['weight_load']:.2f}s")
+    logger.info(f"Model max sequence length: {loaded.get_max_seq_length()}")
+
+    # Warm up the model
+    started = time.perf_counter()
+    _ = loaded.encode(["query: test", "passage: test"], convert_to_numpy=True)
+    startup_timings["warm_up"] = time.perf_counter() - started
+    logger.info(f"Model warmed up in {startup_timings['warm_up']:.2f}s")
+
+    if RERANK_MODEL_NAME:
+        started = time.perf_counter()
+        loaded_reranker = CrossEncoder(RERANK_MODEL_PATH or RERANK_MODEL_NAME, max_length=512, device=device)
+        loaded_reranker.predict([("test", "test")], show_progress_bar=False)
+        startup_timings["reranker_load"] = time.perf_counter() - started
+        logger.info(f"Loaded reranker {RERANK_MODEL_NAME} in {startup_timings['reranker_load']:.2f}s")
+        rerank_batcher.model = loaded_reranker
+
+    registry.attach(MODEL_NAME, loaded, batcher)
+    model = loaded
+    model_state = "ready"
+
+async def load_model_in_background():
+    global model_state, model_error
+
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, load_and_warm_up)
     except Exception as e:
+        model_state = "failed"
+        model_error = str(e)
         logger.error(f"Failed to load model: {e}")
-        raise
+
+def configure_torch_threads():
+    """Apply the configured torch thread pool sizes before any inference runs"""
+    if TORCH_THREADS > 0:
+        torch.set_num_threads(TORCH_THREADS)
+    if TORCH_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+        except RuntimeError as e:
+            # Torch only allows this before the inter-op pool has started
+            logger.warning(f"Could not set inter-op threads: {e}")
+    logger.info(
+        f"Torch uses {torch.get_num_threads()} intra-op and "
+        f"{torch.get_num_interop_threads()} inter-op threads"
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application lifespan manager for model loading"""
+    configure_torch_threads()
+    loader = None
+    if LOAD_MODE == "blocking":
+        try:
+            load_and_warm_up()
+        except Exception as e:
+            logger.error(f"Failed to load model: {e}")
+            raise
+    else:
+        # The server starts answering /livez while weights load
+        loader = asyncio.create_task(load_model_in_background())
+
+    cache.open()
+    passage_cache.open()
+    if cache.path:
+        logger.info(f"Persistent embedding cache at {cache.path}")
+    if vector_index.load():
+        logger.info(f"Loaded corpus index with {len(vector_index)} documents from {vector_index.path}")
+    batcher.start()
+    rerank_batcher.start()
+    logger.info(
+        f"Batching up to {batcher.max_batch_size} texts, waiting at most {MAX_BATCH_WAIT_MS}ms, "
+        f"on {batcher.workers} inference worker(s)"
+    )
 
     yield
 
     logger.info("Shutting down embedding service...")
+    if loader is not None and not loader.done():
+        loader.cancel()
+    await registry.stop()
+    await batcher.stop()
+    await rerank_batcher.stop()
+    cache.close()
+    passage_cache.close()
+    if vector_index.path:
+        await vector_index.run_locked(vector_index.save)
 
 # Create FastAPI app with lifespan
 app = FastAPI(
     title="Polish Embedding Service",
     description="Multilingual embedding service optimized for Polish supplement and health data",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    dependencies=[Depends(request_scheduling)]
 )
 
 # Add CORS middleware
@@ -81,8 +2714,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Binary /embed responses carry their layout in headers browsers hide by default
+    expose_headers=["X-Embedding-Shape", "X-Embedding-Dtype", "X-Embedding-Chunks"],
 )
 
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: the process is up and its event loop is responsive"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: only ready once the model is loaded and warmed up"""
+    body = {
+        "status": model_state,
+        "model": MODEL_NAME,
+        "source": MODEL_PATH or "hub",
+        "backend": INFERENCE_BACKEND,
+        "startup_seconds": startup_timings,
+    }
+    if model_error:
+        body["error"] = model_error
+    if model is None:
+        return JSONResponse(body, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return body
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
@@ -102,57 +2758,95 @@ async def health_check():
 
     return HealthResponse(
         status="healthy",
-        model=model.get_sentence_embedding_dimension(),
+        model=MODEL_NAME,
         device=device,
-        memory_usage=memory_usage
+        memory_usage=memory_usage,
+        queue={
+            **batcher.stats(),
+            "models": {model_batcher.name: model_batcher.stats() for model_batcher in active_batchers()},
+        },
+        cache={**cache.stats(), "passages": passage_cache.stats()},
+        index=vector_index.stats()
     )
 
-@app.post("/embed", response_model=EmbeddingResponse)
-async def create_embeddings(request: EmbeddingRequest):
-    """Generate embeddings for given texts"""
+@app.post(
+    "/embed",
+    response_model=EmbeddingResponse,
+    responses={200: {"content": {RAW_MEDIA_TYPE: {}, NPY_MEDIA_TYPE: {}}}}
+)
+async def create_embeddings(request: EmbeddingRequest, accept: Optional[str] = Header(None)):
+    """Generate embeddings for given texts
+
+    Send ``Accept: application/octet-stream`` for raw little-endian vectors or
+    ``Accept: application/x-npy`` for a .npy file; the shape and dtype are in
+    the ``X-Embedding-Shape`` and ``X-Embedding-Dtype`` headers. JSON clients
+    can ask for ``encoding_format: "base64"`` to get the packed bytes instead
+    of nested float lists.
+
+    ``chunking`` splits texts longer than the model's sequence length into
+    token windows instead of letting them be truncated, returning either one
+    pooled vector per text or one vector per chunk plus its character span.
+
+    ``token_ids`` replaces ``texts`` for clients that already ran the
+    model's tokenizer on the prefixed texts; those inputs skip tokenization.
+
+    ``output_dim`` shrinks each vector, either by keeping its leading
+    dimensions or, with ``reduction: "pca"``, by projecting it through the
+    PCA matrix stored with the model; normalized vectors are renormalized.
+    """
     if model is None:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Model not loaded"
         )
 
+    if (request.texts is None) == (request.token_ids is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Send exactly one of texts and token_ids"
+        )
+
+    if request.token_ids is not None and request.chunking is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="chunking needs texts, not token_ids"
+        )
+
     start_time = time.time()
 
     try:
-        # Preprocess texts for multilingual-e5-large
-        # The model expects a prefix for optimal performance
-        processed_texts = []
-        for text in request.texts:
-            # Add prefix for better multilingual performance
-            if text.startswith("query:") or text.startswith("passage:"):
-                processed_texts.append(text)
-            else:
-                # For general text, add passage prefix
-                processed_texts.append(f"passage: {text}")
+        chunks = None
+        if request.token_ids is not None:
+            embeddings = await embed_token_ids(request.token_ids, request.normalize, request.model_name)
+        elif request.chunking is not None:
+            embeddings, chunk_map = await embed_chunked(request)
+            if request.chunking.pooling == "none":
+                chunks = chunk_map
+        else:
+            # Preprocess texts for multilingual-e5-large
+            # The model expects a prefix for optimal performance
+            processed_texts = prefix_texts(request.texts)
 
-        # Generate embeddings
-        embeddings = model.encode(
-            processed_texts,
-            convert_to_numpy=True,
-            normalize_embeddings=request.normalize,
-            batch_size=32,
-            show_progress_bar=False
-        )
+            # Serve cached texts directly; the rest share a batch with concurrent requests
+            embeddings = await embed_texts(processed_texts, request.normalize, request.model_name)
 
-        processing_time = time.time() - start_time
+        if request.output_dim is not None:
+            projection = output_projection(request.model_name, request.output_dim, request.reduction)
+            embeddings = reduce_dimensions(embeddings, request.output_dim, projection, request.normalize)
 
-        logger.info(f"Generated {len(request.texts)} embeddings in {processing_time".2f"}s")
+        processing_time = time.time() - start_time
 
-        # Convert numpy arrays to lists for JSON serialization
-        embedding_lists = embeddings.tolist()
+        logger.info(f"Generated {len(embeddings)} embeddings in {processing_time:.2f}s")
 
-        return EmbeddingResponse(
-            embeddings=embedding_lists,
-            model="intfloat/multilingual-e5-large",
-            processing_time=processing_time,
-            device=device
-        )
+        with STAGE_SECONDS.labels("serialization").time():
+            return encode_embedding_response(embeddings, request, accept, processing_time, chunks)
 
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    except DeadlineExceededError as e:
+        raise deadline_exception(e)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating embeddings: {e}")
         raise HTTPException(
@@ -160,49 +2854,117 @@ async def create_embeddings(request: EmbeddingRequest):
             detail=f"Embedding generation failed: {str(e)}"
         )
 
+@app.post("/embed/stream")
+async def create_embeddings_stream(
+    request: Request,
+    normalize: bool = True,
+    model_name: Optional[str] = None,
+    encoding_format: Literal["float", "base64"] = Query("float")
+):
+    """Bulk-embed an NDJSON upload of ``{"id", "text"}`` records
+
+    Results stream back as NDJSON ``{"id", "embedding"}`` records, in input
+    order, as each internal batch finishes, so a whole corpus can be
+    re-indexed in one request. Unparseable lines produce ``{"line",
+    "error"}`` records instead of aborting the stream.
+    """
+    if model is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model not loaded"
+        )
+
+    if model_name is not None and model_name not in registry.entries:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown model '{model_name}'")
+
+    return BodyStreamingResponse(
+        stream_embeddings(request, normalize, model_name, encoding_format),
+        media_type="application/x-ndjson"
+    )
+
 @app.post("/similarity")
-async def calculate_similarity(request: EmbeddingRequest):
-    """Calculate cosine similarity between texts"""
+async def calculate_similarity(request: SimilarityRequest):
+    """Calculate cosine similarity between texts
+
+    Without ``corpus`` every text is scored against every other text; with
+    ``corpus`` each text is treated as a query and scored against the corpus
+    only. ``upper_triangle`` trims the pairwise matrix to the entries above
+    the diagonal and ``top_k`` returns only each row's best neighbours.
+
+    ``rerank`` (with ``corpus`` and ``top_k``) rescores each query's best
+    ``rerank_candidates`` corpus matches with the cross-encoder, so a small
+    bi-encoder can do the candidate pass. Pairs from concurrent requests
+    share cross-encoder batches; if scoring overruns ``rerank_budget_ms``,
+    the bi-encoder order is returned with ``reranked`` false.
+    """
     if model is None:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Model not loaded"
         )
 
-    if len(request.texts) < 2:
+    if request.corpus is None and len(request.texts) < 2:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Need at least 2 texts for similarity calculation"
         )
 
+    if request.upper_triangle and (request.corpus is not None or request.top_k is not None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="upper_triangle only applies to the full pairwise matrix"
+        )
+
+    if request.rerank:
+        if rerank_batcher.model is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Reranking is not enabled; set EMBEDDING_RERANK_MODEL"
+            )
+        if request.corpus is None or request.top_k is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="rerank needs a corpus and top_k"
+            )
+
     try:
-        # Generate embeddings
-        embeddings = model.encode(
-            [f"passage: {text}" for text in request.texts],
-            convert_to_numpy=True,
-            normalize_embeddings=True,
-            show_progress_bar=False
-        )
-
-        # Calculate pairwise similarities
-        similarities = []
-        for i in range(len(embeddings)):
-            row = []
-            for j in range(len(embeddings)):
-                if i == j:
-                    row.append(1.0)
-                else:
-                    # Cosine similarity
-                    similarity = np.dot(embeddings[i], embeddings[j])
-                    row.append(float(similarity))
-            similarities.append(row)
+        # Embed both sides in one submission so they share a batch
+        if request.corpus is None:
+            processed_texts = prefix_texts(request.texts)
+        else:
+            processed_texts = prefix_texts(request.texts, "query: ") + prefix_texts(request.corpus)
+        embeddings = await embed_texts(processed_texts, request.normalize, request.model_name)
 
-        return {
-            "similarities": similarities,
-            "texts": request.texts,
-            "model": "intfloat/multilingual-e5-large"
-        }
+        queries = embeddings[:len(request.texts)]
+        targets = embeddings if request.corpus is None else embeddings[len(request.texts):]
+        scores = similarity_matrix(queries, targets, pairwise=request.corpus is None, normalized=request.normalize)
+
+        response: Dict[str, Any] = {"texts": request.texts, "model": request.model_name or MODEL_NAME}
+        if request.rerank:
+            candidates = max(request.top_k, request.rerank_candidates or request.top_k)
+            response["neighbours"], response["reranked"] = await rerank_neighbours(
+                [split_prefix(text)[1] for text in request.texts],
+                [split_prefix(text)[1] for text in request.corpus],
+                top_k_neighbours(scores, candidates),
+                request.top_k,
+                candidates,
+                request.rerank_budget_ms
+            )
+        elif request.top_k is not None:
+            response["neighbours"] = top_k_neighbours(scores, request.top_k, exclude_self=request.corpus is None)
+        elif request.upper_triangle:
+            response["similarities"] = [scores[i, i + 1:].tolist() for i in range(len(scores))]
+        else:
+            response["similarities"] = scores.tolist()
+
+        return JSONResponse(response)
 
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    except DeadlineExceededError as e:
+        raise deadline_exception(e)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logger.error(f"Error calculating similarity: {e}")
         raise HTTPException(
@@ -210,21 +2972,509 @@ async def calculate_similarity(request: EmbeddingRequest):
             detail=f"Similarity calculation failed: {str(e)}"
         )
 
+def require_model():
+    if model is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model not loaded"
+        )
+
+@app.post("/index/upsert")
+async def upsert_documents(request: IndexUpsertRequest):
+    """Embed documents as passages and add or replace them in the corpus index"""
+    require_model()
+
+    try:
+        embeddings = await embed_texts(prefix_texts([doc.text for doc in request.documents]), True)
+        async with vector_index.write_lock:
+            vector_index.upsert(
+                [doc.id for doc in request.documents],
+                embeddings,
+                [{"text": doc.text, "metadata": doc.metadata} for doc in request.documents]
+            )
+        return {"upserted": len(request.documents), "documents": len(vector_index)}
+
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    except DeadlineExceededError as e:
+        raise deadline_exception(e)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error upserting documents: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Index upsert failed: {str(e)}"
+        )
+
+@app.post("/index/delete")
+async def delete_documents(request: IndexDeleteRequest):
+    """Remove documents from the corpus index"""
+    async with vector_index.write_lock:
+        deleted = vector_index.delete(request.ids)
+    return {"deleted": deleted, "documents": len(vector_index)}
+
+@app.post("/index/snapshot")
+async def snapshot_index():
+    """Write the corpus index to EMBEDDING_INDEX_PATH"""
+    if not vector_index.path:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="EMBEDDING_INDEX_PATH is not configured"
+        )
+
+    await vector_index.run_locked(vector_index.save)
+    return {"documents": len(vector_index), "path": vector_index.path}
+
+@app.get("/index")
+async def index_stats():
+    """Corpus index size and layout"""
+    return vector_index.stats()
+
+@app.post("/search")
+async def search_index(request: SearchRequest):
+    """Find the corpus documents closest to each query
+
+    Un-prefixed queries get the e5 ``query:`` prefix. ``approximate`` switches
+    to IVF search once the corpus holds at least EMBEDDING_INDEX_IVF_MIN_SIZE
+    documents; smaller corpora are always searched exactly.
+
+    ``mode="lexical"`` ranks by BM25 over diacritic-folded, stemmed terms,
+    which catches Latin names, doses and brands that embeddings blur.
+    ``mode="hybrid"`` takes the top ``candidates`` BM25 matches, rescores
+    only those with their vectors and fuses both rankings (reciprocal rank
+    fusion, or ``weighted`` with dense weight ``alpha``).
+    """
+    query_texts = [split_prefix(query)[1] for query in request.queries]
+    if request.mode == "lexical":
+        return JSONResponse({"results": vector_index.search_lexical(query_texts, request.top_k), "model": MODEL_NAME})
+
+    require_model()
+
+    try:
+        queries = await embed_texts(prefix_texts(request.queries, "query: "), True)
+        if request.mode == "hybrid":
+            results = vector_index.search_hybrid(
+                query_texts, queries, request.top_k, request.candidates, request.fusion, request.alpha
+            )
+        else:
+            if request.approximate:
+                await vector_index.refresh_ivf()
+            # A write that lands right after the rebuild makes it stale again; search exactly
+            # rather than rebuild on the event loop
+            approximate = request.approximate and vector_index.ivf_ready
+            results = vector_index.search(queries, request.top_k, approximate, request.nprobe)
+        return JSONResponse({"results": results, "model": MODEL_NAME})
+
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    except DeadlineExceededError as e:
+        raise deadline_exception(e)
+    except Exception as e:
+        logger.error(f"Error searching index: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Search failed: {str(e)}"
+        )
+
+@app.post("/rank")
+async def rank_passages(request: RankRequest):
+    """Rank passages against one query
+
+    The query is embedded with the e5 ``query:`` prefix and passages with
+    ``passage:``. ``passage_ids`` scores documents already in the corpus
+    index without embedding them; raw ``passages`` are embedded through a
+    passage cache kept apart from the query cache, so repeated candidate
+    lists only cost the query. Scores come from one matrix-vector product.
+    """
+    require_model()
+
+    if (request.passage_ids is None) == (request.passages is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Send exactly one of passage_ids and passages"
+        )
+
+    if request.passage_ids is not None and request.model_name not in (None, MODEL_NAME):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The corpus index holds {MODEL_NAME} embeddings"
+        )
+
+    try:
+        query_texts = prefix_texts([request.query], "query: ")
+        if request.passage_ids is not None:
+            passages = vector_index.get(request.passage_ids)
+            query = await embed_texts(query_texts, True, request.model_name)
+        else:
+            query, passages = await asyncio.gather(
+                embed_texts(query_texts, True, request.model_name),
+                embed_texts(prefix_texts(request.passages), True, request.model_name, passage_cache)
+            )
+
+        scores = similarity_matrix(query, passages)
+        ranked = top_k_neighbours(scores, request.top_k or len(passages))[0]
+        if request.passage_ids is not None:
+            ranked = [{"id": request.passage_ids[match["index"]], **match} for match in ranked]
+
+        return JSONResponse({"results": ranked, "model": request.model_name or MODEL_NAME})
+
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    except DeadlineExceededError as e:
+        raise deadline_exception(e)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error ranking passages: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ranking failed: {str(e)}"
+        )
+
+@app.post("/graph/knn", responses={200: {"content": {RAW_MEDIA_TYPE: {}}}})
+async def build_knn_graph(request: KnnGraphRequest, accept: Optional[str] = Header(None)):
+    """Link every node to its k most similar nodes
+
+    ``nodes`` are embedded as passages; without them the graph covers the
+    corpus index as stored. The graph comes back as CSR arrays: the
+    neighbours of node ``i`` are ``indices[indptr[i]:indptr[i + 1]]``, best
+    first. ``Accept: application/octet-stream`` returns the packed binary
+    layout of ``encode_knn_graph`` instead of JSON.
+    """
+    require_model()
+
+    if request.nodes is None and request.model_name not in (None, MODEL_NAME):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The corpus index holds {MODEL_NAME} embeddings"
+        )
+
+    try:
+        if request.nodes is not None:
+            ids = [node.id for node in request.nodes]
+            if len(set(ids)) != len(ids):
+                raise ValueError("Node ids must be unique")
+            vectors = await embed_in_slices(prefix_texts([node.text for node in request.nodes]), True, request.model_name)
+        else:
+            if len(vector_index) < 2:
+                raise ValueError("The corpus index needs at least 2 documents")
+            # Copy so concurrent upserts and deletes cannot shift rows under the build
+            ids, vectors = list(vector_index.ids), vector_index.vectors.copy()
+
+        loop = asyncio.get_running_loop()
+        indptr, indices, scores = await loop.run_in_executor(None, knn_graph, vectors, request.k, request.min_score)
+
+        if RAW_MEDIA_TYPE in (accept or "").lower():
+            return Response(content=encode_knn_graph(ids, indptr, indices, scores), media_type=RAW_MEDIA_TYPE)
+        return JSONResponse({
+            "ids": ids,
+            "indptr": indptr.tolist(),
+            "indices": indices.tolist(),
+            "scores": np.round(scores, 4).tolist(),
+            "model": request.model_name or MODEL_NAME
+        })
+
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    except DeadlineExceededError as e:
+        raise deadline_exception(e)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error building kNN graph: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"kNN graph failed: {str(e)}"
+        )
+
+def group_documents(
+    ids: List[str],
+    vectors: np.ndarray,
+    threshold: float,
+    n_clusters: Optional[int]
+) -> Dict[str, Any]:
+    """Duplicate groups (largest first) and, when asked, k-means cluster assignments"""
+    labels = duplicate_groups(vectors, threshold)
+    members: Dict[int, List[str]] = {}
+    for doc_id, label in zip(ids, labels.tolist()):
+        members.setdefault(label, []).append(doc_id)
+    groups = sorted((group for group in members.values() if len(group) > 1), key=len, reverse=True)
+    result: Dict[str, Any] = {
+        "documents": len(ids),
+        "duplicate_groups": groups,
+        "duplicates": sum(len(group) - 1 for group in groups),
+    }
+
+    if n_clusters is not None:
+        centroids = minibatch_kmeans(vectors, n_clusters)
+        assignments = assign_clusters(vectors, centroids)
+        # The member closest to each centroid stands for its cluster: sorted by
+        # cluster, then closeness, it is the first row of its cluster's run
+        closeness = np.einsum("ij,ij->i", vectors, centroids[assignments])
+        order = np.lexsort((-closeness, assignments))
+        sizes = np.bincount(assignments, minlength=n_clusters)
+        starts = np.cumsum(sizes) - sizes
+        result["clusters"] = {
+            "assignments": assignments.tolist(),
+            "sizes": sizes.tolist(),
+            "representatives": [
+                ids[order[start]] if size else None for start, size in zip(starts.tolist(), sizes.tolist())
+            ],
+        }
+    return result
+
+@app.post("/cluster")
+async def cluster_documents(request: ClusterRequest):
+    """Find near-duplicate documents and optionally cluster them
+
+    ``documents`` are embedded as passages (identical texts only once);
+    without them the corpus index is grouped as stored. Documents whose
+    cosine similarity reaches ``threshold`` are linked, and each connected
+    set of two or more is returned as a duplicate group. ``n_clusters``
+    adds mini-batch k-means assignments. Similarities are scored in
+    bounded tiles, never as a full N x N matrix.
+    """
+    require_model()
+
+    if request.documents is None and request.model_name not in (None, MODEL_NAME):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The corpus index holds {MODEL_NAME} embeddings"
+        )
+
+    try:
+        count = len(request.documents) if request.documents is not None else len(vector_index)
+        if request.n_clusters is not None and request.n_clusters > count:
+            raise ValueError(f"n_clusters must not exceed the {count} documents")
+
+        if request.documents is not None:
+            ids = [doc.id for doc in request.documents]
+            if len(set(ids)) != len(ids):
+                raise ValueError("Document ids must be unique")
+            vectors = await embed_in_slices(prefix_texts([doc.text for doc in request.documents]), True, request.model_name)
+        else:
+            if count < 2:
+                raise ValueError("The corpus index needs at least 2 documents")
+            # Copy so concurrent upserts and deletes cannot shift rows under the scan
+            ids, vectors = list(vector_index.ids), vector_index.vectors.copy()
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            None, group_documents, ids, vectors, request.threshold, request.n_clusters
+        )
+        return JSONResponse({**result, "model": request.model_name or MODEL_NAME})
+
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    except DeadlineExceededError as e:
+        raise deadline_exception(e)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error clustering documents: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Clustering failed: {str(e)}"
+        )
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, batch sizes, throughput counters and process RSS"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/models")
 async def list_models():
-    """List available models (currently only one)"""
+    """List servable models with their loaded state and weight memory"""
     return {
-        "models": [
-            {
-                "name": "intfloat/multilingual-e5-large",
-                "description": "Multilingual embedding model optimized for Polish text",
-                "dimensions": 1024,
-                "languages": ["Polish", "English", "German", "French", "Spanish", "Italian", "Dutch", "Russian", "Chinese", "Japanese"],
-                "recommended_for": ["supplement descriptions", "health conditions", "medical terms", "user queries"]
-            }
-        ]
+        "models": registry.describe(),
+        "default": MODEL_NAME,
+        "memory_budget_mb": round(registry.memory_budget / 1024**2, 1),
+        "loaded_mb": round(registry.loaded_bytes() / 1024**2, 1),
+        "loads": registry.loads,
+        "unloads": registry.unloads,
+        "reranker": {"model": RERANK_MODEL_NAME, "loaded": rerank_batcher.model is not None}
     }
 
-if __name__ == "__main__":
+def parse_cpulist(text: str) -> List[int]:
+    """Expand a sysfs CPU list such as ``0-3,8-11``"""
+    cpus = []
+    for part in text.strip().split(","):
+        if part:
+            start, _, end = part.partition("-")
+            cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+def numa_nodes() -> Dict[int, List[int]]:
+    """CPUs this process may run on, grouped by NUMA node"""
+    allowed = os.sched_getaffinity(0)
+    nodes = {}
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        node = int(os.path.basename(os.path.dirname(path))[len("node"):])
+        with open(path) as f:
+            cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in allowed]
+        if cpus:
+            nodes[node] = cpus
+    return nodes or {0: sorted(allowed)}
+
+def plan_worker_layout(workers: int, pinning: str) -> List[Dict[str, Any]]:
+    """Give each worker a NUMA node and CPU set; ``none`` leaves placement to the scheduler"""
+    allowed = sorted(os.sched_getaffinity(0))
+    if pinning == "none":
+        return [{"node": None, "cpus": None} for _ in range(workers)]
+    if pinning not in ("cores", "numa"):
+        raise ValueError(f"Unknown worker pinning '{pinning}', expected none, cores or numa")
+    if workers > len(allowed):
+        raise ValueError(f"Cannot pin {workers} workers to {len(allowed)} CPUs")
+
+    if pinning == "cores":
+        return [{"node": None, "cpus": group.tolist()} for group in np.array_split(allowed, workers)]
+
+    nodes = list(numa_nodes().items())
+    layout = []
+    # Spread workers over the nodes as evenly as possible, then split each node's CPUs
+    for index, (node, cpus) in enumerate(nodes):
+        count = workers * (index + 1) // len(nodes) - workers * index // len(nodes)
+        if count > len(cpus):
+            raise ValueError(f"Cannot pin {count} workers to the {len(cpus)} CPUs of NUMA node {node}")
+        if count:
+            layout.extend({"node": node, "cpus": group.tolist()} for group in np.array_split(cpus, count))
+    return layout
+
+def supervise(children: List[Any], label: str):
+    """Fork one process per callable, restart any that exit, and pass SIGTERM/SIGINT on"""
+    running: Dict[int, int] = {}
+    stopping = False
+
+    def start(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                children[slot]()
+            except BaseException:
+                logger.exception(f"{label} {slot} failed")
+                code = 1
+            finally:
+                os._exit(code)
+        running[pid] = slot
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(running):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(len(children)):
+        start(slot)
+
+    while running:
+        try:
+            pid, wait_status = os.wait()
+        except ChildProcessError:
+            break
+        slot = running.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        logger.warning(
+            f"{label} {slot} (pid {pid}) exited with status {os.waitstatus_to_exitcode(wait_status)}, restarting"
+        )
+        time.sleep(1)
+        start(slot)
+
+def serve_worker(listener: socket.socket, cpus: Optional[List[int]], threads: int):
+    """Run one uvicorn server on the shared listening socket"""
+    global TORCH_THREADS, TORCH_INTEROP_THREADS
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    TORCH_THREADS = threads
+    # Batches already run on the batcher's own threads
+    TORCH_INTEROP_THREADS = TORCH_INTEROP_THREADS or 1
+    logger.info(f"Worker {os.getpid()} on CPUs {cpus or 'unpinned'} with {threads} intra-op threads")
+    uvicorn.Server(uvicorn.Config(app)).run(sockets=[listener])
+
+def launch(host: str, port: int, workers: int, pinning: str, threads_per_worker: int = 0):
+    """Serve from ``workers`` processes that share one listening socket and one copy of the weights.
+
+    The weights are loaded once and the workers are forked afterwards, so the
+    tensors stay in shared copy-on-write pages instead of being copied per
+    process. With ``numa`` pinning there is one copy per node instead: a
+    leader process pinned to the node loads it (so first-touch allocation
+    keeps it in that node's memory) and forks that node's workers. Intra-op
+    threads default to the worker's CPU count, so N workers never run more
+    than one thread per core between them. ONNX Runtime sessions are not
+    fork-safe, so with the onnx backends every worker loads its own.
+    """
+    layout = plan_worker_layout(workers, pinning)
+    cpu_count = len(os.sched_getaffinity(0))
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(2048)
+    listener.set_inheritable(True)
+
+    def load_weights():
+        global preloaded_model
+        if INFERENCE_BACKEND.startswith("onnx"):
+            return
+        # Single-threaded so no OpenMP pool exists yet when the workers fork
+        torch.set_num_threads(1)
+        started = time.perf_counter()
+        preloaded_model = load_model(MODEL_PATH or MODEL_NAME)
+        logger.info(f"Loaded shared weights in {time.perf_counter() - started:.2f}s")
+
+    def worker(entry: Dict[str, Any]):
+        cpus = entry["cpus"]
+        threads = threads_per_worker or max(1, len(cpus) if cpus else cpu_count // workers)
+        return lambda: serve_worker(listener, cpus, threads)
+
+    logger.info(f"Starting {workers} workers on {host}:{port} with {pinning} pinning")
+    if pinning != "numa":
+        load_weights()
+        supervise([worker(entry) for entry in layout], "Worker")
+        return
+
+    by_node: Dict[int, List[Dict[str, Any]]] = {}
+    for entry in layout:
+        by_node.setdefault(entry["node"], []).append(entry)
+
+    def leader(node: int, entries: List[Dict[str, Any]]):
+        def run():
+            os.sched_setaffinity(0, [cpu for entry in entries for cpu in entry["cpus"]])
+            load_weights()
+            supervise([worker(entry) for entry in entries], f"NUMA node {node} worker")
+        return run
+
+    supervise([leader(node, entries) for node, entries in by_node.items()], "NUMA node leader")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the embedding service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Worker processes sharing the weights")
+    parser.add_argument("--pinning", choices=["none", "cores", "numa"], default=WORKER_PINNING)
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=TORCH_THREADS,
+        help="Torch intra-op threads per worker; defaults to the worker's share of the CPUs"
+    )
+    args = parser.parse_args()
+
+    if args.workers == 1 and args.pinning == "none":
+        import uvicorn
+        TORCH_THREADS = args.threads_per_worker
+        uvicorn.run(app, host=args.host, port=args.port)
+    else:
+        launch(args.host, args.port, args.workers, args.pinning, args.threads_per_worker)
\ No newline at end of file
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Compare embedding-service inference backends
+Runs each backend in its own process on a fixed Polish test set and reports
+throughput, peak RSS and cosine agreement with the PyTorch fp32 vectors
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+SERVICE_PATH = Path(__file__).resolve().parent.parent / "embedding-service.py"
+
+POLISH_TEST_SET = [
+    "query: magnez na sen",
+    "query: co pomaga na koncentrację",
+    "query: witamina D zimą dawkowanie",
+    "query: suplementy na stres i lęk",
+    "query: czy kreatyna jest bezpieczna dla nerek",
+    "query: omega-3 a zdrowie serca",
+    "passage: Magnez uczestniczy w ponad 300 reakcjach enzymatycznych i wspiera prawidłowe funkcjonowanie układu nerwowego.",
+    "passage: Cholekalcyferol (witamina D3) jest syntetyzowany w skórze pod wpływem promieniowania UVB.",
+    "passage: Ashwagandha (Withania somnifera) w badaniach klinicznych obniżała poziom kortyzolu u osób przewlekle zestresowanych.",
+    "passage: L-teanina, aminokwas obecny w zielonej herbacie, zwiększa aktywność fal alfa w mózgu bez wywoływania senności.",
+    "passage: Kwasy EPA i DHA wbudowują się w błony komórkowe neuronów i wpływają na ich płynność oraz przekaźnictwo synaptyczne.",
+    "passage: Monohydrat kreatyny zwiększa zasoby fosfokreatyny w mięśniach, co poprawia wydolność w krótkich, intensywnych wysiłkach.",
+    "passage: Melatonina reguluje rytm dobowy; dawki 0,5–3 mg przyjmowane przed snem skracają czas zasypiania.",
+    "passage: Bacopa monnieri stosowana przez co najmniej 12 tygodni poprawiała szybkość przetwarzania informacji i pamięć w randomizowanych badaniach kontrolowanych placebo. Efekty pojawiają się stopniowo, a najczęstsze działania niepożądane dotyczą układu pokarmowego.",
+    "passage: Cynk i miedź konkurują o wchłanianie w jelitach, dlatego długotrwała suplementacja wysokich dawek cynku może prowadzić do niedoboru miedzi.",
+    "passage: Rhodiola rosea należy do adaptogenów; w badaniach zmniejszała zmęczenie psychiczne i poprawiała wydajność pracy umysłowej w warunkach stresu.",
+    "passage: Żelazo w postaci diglicynianu jest lepiej tolerowane niż siarczan żelaza i rzadziej powoduje zaparcia.",
+    "passage: Witamina K2 (MK-7) aktywuje osteokalcynę oraz białko MGP, kierując wapń do kości zamiast do ścian naczyń krwionośnych.",
+]
+
+BACKENDS = ["torch", "torch-int8", "onnx", "onnx-int8"]
+
+
+def load_service():
+    """Import embedding-service.py, whose file name is not a valid module name"""
+    spec = importlib.util.spec_from_file_location("embedding_service", SERVICE_PATH)
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+    return service
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend, model_name, repeats, batch_size, output):
+    """Measure one backend in this process and save its vectors to ``output``"""
+    started = time.perf_counter()
+    service = load_service()
+    model = service.load_model(model_name or service.MODEL_NAME, backend)
+    load_seconds = time.perf_counter() - started
+
+    model.encode(POLISH_TEST_SET[:2], batch_size=batch_size, convert_to_numpy=True)
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        embeddings = model.encode(
+            POLISH_TEST_SET,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+    elapsed = time.perf_counter() - started
+
+    np.save(output, np.asarray(embeddings, dtype=np.float32))
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "texts_per_sec": len(POLISH_TEST_SET) * repeats / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding inference backends")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends")
+    parser.add_argument("--model", help="Model name, defaults to the service's model")
+    parser.add_argument("--repeats", type=int, default=5, help="Passes over the test set per backend")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--json", dest="json_path", help="Write results to this JSON file")
+    parser.add_argument("--run-backend", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_backend:
+        result = run_backend(args.run_backend, args.model, args.repeats, args.batch_size, args.output)
+        print(json.dumps(result))
+        return
+
+    backends = args.backends.split(",")
+    if "torch" not in backends:
+        # fp32 vectors are the reference for cosine agreement
+        backends.insert(0, "torch")
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in backends:
+            output = os.path.join(workdir, f"{backend}.npy")
+            command = [
+                sys.executable, __file__,
+                "--run-backend", backend,
+                "--output", output,
+                "--repeats", str(args.repeats),
+                "--batch-size", str(args.batch_size),
+            ]
+            if args.model:
+                command += ["--model", args.model]
+
+            # A fresh process per backend keeps RSS numbers independent
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                error_lines = completed.stderr.strip().splitlines()
+                print(f"{backend}: failed: {error_lines[-1] if error_lines else 'no output'}", file=sys.stderr)
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            result["vectors"] = output
+            results.append(result)
+
+        reference = next((np.load(r["vectors"]) for r in results if r["backend"] == "torch"), None)
+        for result in results:
+            vectors = np.load(result.pop("vectors"))
+            if reference is not None:
+                agreement = np.sum(vectors * reference, axis=1)
+                result["cosine_mean"] = float(agreement.mean())
+                result["cosine_min"] = float(agreement.min())
+
+    print(f"{'backend':<12} {'load s':>8} {'texts/s':>9} {'RSS MB':>9} {'cos mean':>9} {'cos min':>9}")
+    for result in results:
+        print(
+            f"{result['backend']:<12} {result['load_seconds']:>8.1f} {result['texts_per_sec']:>9.1f} "
+            f"{result['peak_rss_mb']:>9.0f} {result.get('cosine_mean', float('nan')):>9.4f} "
+            f"{result.get('cosine_min', float('nan')):>9.4f}"
+        )
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"test_set_size": len(POLISH_TEST_SET), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
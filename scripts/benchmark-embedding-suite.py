@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmark suite for the embedding service
+Starts embedding-service.py (by default with the small e5 model on CPU),
+runs a fixed set of scenarios against its endpoints with a closed-loop load
+generator and a fixed Polish/English corpus of short, medium and long texts,
+and records throughput, latency percentiles, peak RSS and per-stage timings
+from /metrics as JSON. With --baseline the run is compared against a stored
+result and exits non-zero on regressions; --update-baseline stores it
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+SERVICE_PATH = SCRIPTS_DIR.parent / "embedding-service.py"
+
+SHORT_TEXTS = [
+    "magnez na sen",
+    "witamina D zimą",
+    "ashwagandha stres",
+    "omega-3 dla mózgu",
+    "kreatyna dawkowanie",
+    "cynk odporność",
+    "melatonin for jet lag",
+    "best nootropic for focus",
+    "rhodiola fatigue",
+    "vitamin K2 bones",
+    "l-teanina i kofeina",
+    "żelazo przy anemii",
+]
+
+MEDIUM_TEXTS = [
+    "Magnez uczestniczy w ponad 300 reakcjach enzymatycznych i wspiera prawidłowe funkcjonowanie układu nerwowego.",
+    "Cholekalcyferol (witamina D3) jest syntetyzowany w skórze pod wpływem promieniowania UVB, dlatego zimą często zaleca się suplementację.",
+    "Ashwagandha (Withania somnifera) w badaniach klinicznych obniżała poziom kortyzolu u osób przewlekle zestresowanych.",
+    "L-teanina, aminokwas obecny w zielonej herbacie, zwiększa aktywność fal alfa w mózgu bez wywoływania senności.",
+    "Kwasy EPA i DHA wbudowują się w błony komórkowe neuronów i wpływają na ich płynność oraz przekaźnictwo synaptyczne.",
+    "Monohydrat kreatyny zwiększa zasoby fosfokreatyny w mięśniach, co poprawia wydolność w krótkich, intensywnych wysiłkach.",
+    "Melatonin regulates the circadian rhythm; doses of 0.5 to 3 mg taken before bedtime shorten the time needed to fall asleep.",
+    "Bacopa monnieri taken for at least twelve weeks improved information processing speed and memory in placebo-controlled trials.",
+    "Zinc and copper compete for intestinal absorption, so long-term high-dose zinc supplementation can lead to copper deficiency.",
+    "Rhodiola rosea is an adaptogen that reduced mental fatigue and improved work performance under stress in several studies.",
+    "Żelazo w postaci diglicynianu jest lepiej tolerowane niż siarczan żelaza i rzadziej powoduje zaparcia.",
+    "Vitamin K2 as MK-7 activates osteocalcin and matrix Gla protein, directing calcium to bone instead of arterial walls.",
+]
+
+# Long passages are built from the medium ones so they exceed a typical query by 10-20x
+LONG_TEXTS = [
+    " ".join(MEDIUM_TEXTS[i:] + MEDIUM_TEXTS[:i]) for i in range(0, len(MEDIUM_TEXTS), 3)
+]
+
+
+def load_percentile():
+    """Reuse the load generator's percentile from benchmark-embedding.py"""
+    spec = importlib.util.spec_from_file_location("benchmark_embedding", SCRIPTS_DIR / "benchmark-embedding.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.percentile
+
+
+percentile = load_percentile()
+
+
+def unique(texts, marker):
+    """Make texts distinct per request so the service's caches do not answer them"""
+    return [f"{text} [{marker}]" for text in texts]
+
+
+def embed_short(rng, n):
+    return {"texts": unique(rng.sample(SHORT_TEXTS, rng.randint(1, 4)), n)}
+
+
+def embed_medium(rng, n):
+    return {"texts": unique(rng.sample(MEDIUM_TEXTS, rng.randint(2, 8)), n)}
+
+
+def embed_long(rng, n):
+    return {"texts": unique(rng.sample(LONG_TEXTS, rng.randint(1, 2)), n)}
+
+
+def embed_mixed_binary(rng, n):
+    texts = rng.sample(SHORT_TEXTS, 4) + rng.sample(MEDIUM_TEXTS, 3) + rng.sample(LONG_TEXTS, 1)
+    return {"texts": unique(texts, n)}
+
+
+def embed_cached(rng, n):
+    # Popular queries repeated verbatim exercise the cache and in-flight de-duplication
+    return {"texts": rng.sample(SHORT_TEXTS[:4], rng.randint(1, 3))}
+
+
+def similarity_corpus(rng, n):
+    return {
+        "texts": unique(rng.sample(SHORT_TEXTS, 2), n),
+        "corpus": unique(MEDIUM_TEXTS, n),
+        "top_k": 3,
+    }
+
+
+def search(rng, n):
+    return {"queries": unique(rng.sample(SHORT_TEXTS, rng.randint(1, 3)), n), "top_k": 5}
+
+
+def index_corpus(base_url):
+    documents = [
+        {"id": f"doc-{i}", "text": text}
+        for i, text in enumerate(MEDIUM_TEXTS + LONG_TEXTS + SHORT_TEXTS)
+    ]
+    post(base_url + "/index/upsert", json.dumps({"documents": documents}).encode("utf-8"), {}, 300.0)
+
+
+# name -> (endpoint, payload builder, request headers, setup run once before the scenario)
+SCENARIOS = {
+    "embed_short": ("/embed", embed_short, {}, None),
+    "embed_medium": ("/embed", embed_medium, {}, None),
+    "embed_long": ("/embed", embed_long, {}, None),
+    "embed_mixed_binary": ("/embed", embed_mixed_binary, {"Accept": "application/octet-stream"}, None),
+    "embed_cached": ("/embed", embed_cached, {}, None),
+    "similarity_corpus": ("/similarity", similarity_corpus, {}, None),
+    "search": ("/search", search, {}, index_corpus),
+}
+
+
+def post(url, body, headers, timeout):
+    request = urllib.request.Request(
+        url, data=body, headers={"Content-Type": "application/json", **headers}, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+        return response.status
+
+
+def count_texts(payload):
+    return sum(len(payload.get(field, [])) for field in ("texts", "corpus", "queries"))
+
+
+def run_scenario(base_url, name, concurrency, requests_per_worker, seed, timeout):
+    """Drive one scenario with ``concurrency`` closed-loop clients"""
+    endpoint, build, headers, _ = SCENARIOS[name]
+    rng = random.Random(f"{seed}:{name}")
+    payloads = [build(rng, n) for n in range(concurrency * requests_per_worker)]
+    bodies = [(json.dumps(payload).encode("utf-8"), count_texts(payload)) for payload in payloads]
+
+    def worker(chunk):
+        latencies, errors, texts = [], 0, 0
+        for body, text_count in chunk:
+            started = time.perf_counter()
+            try:
+                post(base_url + endpoint, body, headers, timeout)
+                latencies.append(time.perf_counter() - started)
+                texts += text_count
+            except Exception:
+                errors += 1
+        return latencies, errors, texts
+
+    chunks = [bodies[i::concurrency] for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, chunks))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for result in results for latency in result[0]]
+    texts = sum(result[2] for result in results)
+    summary = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(result[1] for result in results),
+        "requests_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "texts_per_sec": texts / elapsed if elapsed else 0.0,
+    }
+    for pct in (50, 90, 99):
+        summary[f"p{pct}_ms"] = percentile(latencies, pct) * 1000 if latencies else None
+    return summary
+
+
+STAGE_METRIC = re.compile(r'^embedding_stage_seconds_(sum|count)\{stage="(\w+)"\} (\S+)$')
+
+
+def scrape_stages(base_url):
+    """Cumulative (seconds, observations) per pipeline stage from /metrics"""
+    with urllib.request.urlopen(base_url + "/metrics", timeout=30) as response:
+        text = response.read().decode("utf-8")
+    stages = {}
+    for line in text.splitlines():
+        match = STAGE_METRIC.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            stages.setdefault(stage, {"sum": 0.0, "count": 0.0})[kind] = float(value)
+    return stages
+
+
+def stage_delta(before, after, elapsed):
+    """Per-stage share of wall time and mean duration between two scrapes"""
+    delta = {}
+    for stage, totals in after.items():
+        seconds = totals["sum"] - before.get(stage, {}).get("sum", 0.0)
+        count = totals["count"] - before.get(stage, {}).get("count", 0.0)
+        if count:
+            delta[stage] = {
+                "seconds": seconds,
+                "observations": int(count),
+                "mean_ms": seconds / count * 1000,
+                "busy_fraction": seconds / elapsed if elapsed else 0.0,
+            }
+    return delta
+
+
+def peak_rss_mb(pid):
+    """High-water RSS of a process, from /proc"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_service(port, model_name, extra_env, timeout):
+    env = {
+        **os.environ,
+        "EMBEDDING_MODEL_NAME": model_name,
+        "EMBEDDING_LOAD_MODE": "blocking",
+        "EMBEDDING_WORKERS": "1",
+        **extra_env,
+    }
+    process = subprocess.Popen(
+        [sys.executable, str(SERVICE_PATH), "--host", "127.0.0.1", "--port", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+
+    started = threading.Event()
+    log_tail = []
+
+    def read_log():
+        for line in process.stderr:
+            log_tail[:] = (log_tail + [line.rstrip()])[-20:]
+            if "Application startup complete" in line:
+                started.set()
+        process.wait()
+        started.set()
+
+    threading.Thread(target=read_log, daemon=True).start()
+    if not started.wait(timeout) or process.poll() is not None:
+        process.terminate()
+        process.wait()
+        raise SystemExit("Embedding service did not start:\n" + "\n".join(log_tail[-10:]))
+    return process
+
+
+def environment(model_name):
+    commit = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=SCRIPTS_DIR
+        ).stdout.strip() or None
+    except OSError:
+        pass
+    return {
+        "model": model_name,
+        "cpus": len(os.sched_getaffinity(0)),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "commit": commit,
+    }
+
+
+def format_ms(value):
+    return f"{value:.1f}" if value is not None else "-"
+
+
+def compare(results, baseline, max_throughput_drop, max_latency_increase, max_rss_increase):
+    """Regressions of ``results`` against ``baseline``, as human-readable lines"""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: {current['errors']} errors (baseline {previous['errors']})")
+        if previous["texts_per_sec"] and current["texts_per_sec"] < previous["texts_per_sec"] * (1 - max_throughput_drop):
+            regressions.append(
+                f"{name}: {current['texts_per_sec']:.1f} texts/s, "
+                f"{1 - current['texts_per_sec'] / previous['texts_per_sec']:.0%} below baseline {previous['texts_per_sec']:.1f}"
+            )
+        if previous["p99_ms"] and current["p99_ms"] and current["p99_ms"] > previous["p99_ms"] * (1 + max_latency_increase):
+            regressions.append(
+                f"{name}: p99 {current['p99_ms']:.1f} ms, "
+                f"{current['p99_ms'] / previous['p99_ms'] - 1:.0%} above baseline {previous['p99_ms']:.1f} ms"
+            )
+
+    current_rss, previous_rss = results.get("peak_rss_mb"), baseline.get("peak_rss_mb")
+    if current_rss and previous_rss and current_rss > previous_rss * (1 + max_rss_increase):
+        regressions.append(f"peak RSS {current_rss:.0f} MB, baseline {previous_rss:.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the embedding service benchmark suite")
+    parser.add_argument("--url", help="Benchmark an already running service instead of starting one")
+    parser.add_argument("--pid", type=int, help="Service PID for RSS when using --url")
+    parser.add_argument(
+        "--model",
+        default="intfloat/multilingual-e5-small",
+        help="Model the started service loads; the small e5 model keeps CPU runs short"
+    )
+    parser.add_argument("--env", action="append", default=[], help="Extra NAME=VALUE service environment")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=25, help="Requests per client per scenario")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed requests per client before each scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run to --baseline instead of comparing")
+    parser.add_argument("--max-throughput-drop", type=float, default=0.2, help="Allowed texts/s drop, as a fraction")
+    parser.add_argument("--max-latency-increase", type=float, default=0.3, help="Allowed p99 increase, as a fraction")
+    parser.add_argument("--max-rss-increase", type=float, default=0.2, help="Allowed peak RSS increase, as a fraction")
+    args = parser.parse_args()
+
+    names = args.scenarios.split(",")
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}; available: {', '.join(SCENARIOS)}")
+
+    process = None
+    if args.url:
+        base_url, pid = args.url.rstrip("/"), args.pid
+    else:
+        port = free_port()
+        extra_env = dict(entry.split("=", 1) for entry in args.env)
+        print(f"Starting embedding service with {args.model}...", file=sys.stderr)
+        process = start_service(port, args.model, extra_env, args.startup_timeout)
+        base_url, pid = f"http://127.0.0.1:{port}", process.pid
+
+    results = {"environment": environment(args.model), "settings": vars(args).copy(), "scenarios": {}}
+    try:
+        print(f"{'scenario':<20} {'req/s':>8} {'texts/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for name in names:
+            setup = SCENARIOS[name][3]
+            if setup is not None:
+                setup(base_url)
+            if args.warmup:
+                run_scenario(base_url, name, args.concurrency, args.warmup, args.seed + 1, args.timeout)
+
+            before = scrape_stages(base_url)
+            started = time.perf_counter()
+            summary = run_scenario(base_url, name, args.concurrency, args.requests, args.seed, args.timeout)
+            summary["stages"] = stage_delta(before, scrape_stages(base_url), time.perf_counter() - started)
+            results["scenarios"][name] = summary
+            print(
+                f"{name:<20} {summary['requests_per_sec']:>8.1f} {summary['texts_per_sec']:>9.1f} "
+                f"{format_ms(summary['p50_ms']):>8} {format_ms(summary['p90_ms']):>8} "
+                f"{format_ms(summary['p99_ms']):>8} {summary['errors']:>7}"
+            )
+        results["peak_rss_mb"] = peak_rss_mb(pid) if pid else None
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if results["peak_rss_mb"]:
+        print(f"Peak RSS: {results['peak_rss_mb']:.0f} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if not args.baseline:
+        return
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; skipping comparison", file=sys.stderr)
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(
+        results, baseline, args.max_throughput_drop, args.max_latency_increase, args.max_rss_increase
+    )
+    if regressions:
+        print("\nRegressions against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
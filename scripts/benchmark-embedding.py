@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Load generator for the embedding service
+Fires many small /embed requests at increasing concurrency and reports
+throughput plus p50/p99 latency for each level
+"""
+
+import argparse
+import json
+import math
+import random
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SAMPLE_TEXTS = [
+    "magnez na sen",
+    "witamina D3 z K2 dla odporności",
+    "ashwagandha a poziom kortyzolu",
+    "omega-3 EPA DHA wspiera funkcje poznawcze",
+    "kreatyna monohydrat dawkowanie",
+    "L-teanina i kofeina na koncentrację",
+    "melatonin dosage for jet lag",
+    "rhodiola rosea adaptogen for fatigue",
+    "cynk i miedź - interakcje przy suplementacji",
+    "Bacopa monnieri poprawia pamięć w badaniach klinicznych trwających 12 tygodni",
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of floats"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def post_json(url, payload, timeout, accept="application/json"):
+    body = json.dumps(payload).encode("utf-8")
+    request = urllib.request.Request(
+        url, data=body, headers={"Content-Type": "application/json", "Accept": accept}, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+        return response.status
+
+
+def run_level(url, concurrency, requests_per_worker, min_texts, max_texts, timeout, accept="application/json"):
+    """Run one concurrency level and return its latency summary"""
+    rng = random.Random(concurrency)
+    payloads = [
+        {"texts": rng.sample(SAMPLE_TEXTS, rng.randint(min_texts, max_texts))}
+        for _ in range(concurrency * requests_per_worker)
+    ]
+
+    def worker(chunk):
+        latencies, errors, texts = [], 0, 0
+        for payload in chunk:
+            started = time.perf_counter()
+            try:
+                post_json(url, payload, timeout, accept)
+                latencies.append(time.perf_counter() - started)
+                texts += len(payload["texts"])
+            except Exception:
+                errors += 1
+        return latencies, errors, texts
+
+    chunks = [payloads[i::concurrency] for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, chunks))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for result in results for latency in result[0]]
+    errors = sum(result[1] for result in results)
+    texts = sum(result[2] for result in results)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "texts_per_sec": texts / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /embed latency against concurrency")
+    parser.add_argument("--url", default="http://localhost:8001", help="Embedding service base URL")
+    parser.add_argument("--endpoint", default="/embed", choices=["/embed", "/similarity"])
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per worker per level")
+    parser.add_argument("--min-texts", type=int, default=1)
+    parser.add_argument("--max-texts", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--accept",
+        default="application/json",
+        help="Accept header, e.g. application/octet-stream to benchmark binary responses"
+    )
+    parser.add_argument("--json", dest="json_path", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    # /similarity needs at least two texts per request
+    min_texts = max(args.min_texts, 2) if args.endpoint == "/similarity" else args.min_texts
+    url = args.url.rstrip("/") + args.endpoint
+
+    results = []
+    print(f"{'conc':>6} {'req/s':>9} {'texts/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for level in [int(value) for value in args.concurrency.split(",")]:
+        result = run_level(
+            url, level, args.requests, min_texts, args.max_texts, args.timeout, args.accept
+        )
+        results.append(result)
+        p50 = f"{result['p50_ms']:.1f}" if result["p50_ms"] is not None else "-"
+        p99 = f"{result['p99_ms']:.1f}" if result["p99_ms"] is not None else "-"
+        print(
+            f"{level:>6} {result['requests_per_sec']:>9.1f} {result['texts_per_sec']:>9.1f} "
+            f"{p50:>9} {p99:>9} {result['errors']:>7}"
+        )
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"endpoint": args.endpoint, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Compare dense, lexical and hybrid retrieval on a corpus index snapshot
+Loads a snapshot (EMBEDDING_INDEX_PATH or scripts/embed-corpus.py output),
+embeds the queries once with the service's model and then times each
+retrieval mode on its own, so the figures are search cost only. Reports
+p50/p99 latency, overlap with dense-only top-k and, when queries carry
+relevant ids, recall@k and MRR
+
+Without --queries, queries are random word windows cut from sampled
+documents, each relevant to its own document. These favour exact-term
+lookups, so prefer a labelled query file for tuning fusion
+"""
+
+import argparse
+import importlib.util
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+SERVICE_PATH = Path(__file__).resolve().parent.parent / "embedding-service.py"
+
+
+def load_service():
+    """Import embedding-service.py, whose file name is not a valid module name"""
+    spec = importlib.util.spec_from_file_location("embedding_service", SERVICE_PATH)
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+    return service
+
+
+def read_queries(path):
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                queries.append({"text": record["text"], "relevant": [str(doc_id) for doc_id in record.get("relevant", [])]})
+    return queries
+
+
+def sample_queries(index, count, min_words, max_words, seed):
+    """Word windows cut from random documents, each labelled with its source document"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for row in rng.permutation(len(index))[:count * 4]:
+        words = index.payloads[row].get("text", "").split()
+        if len(words) < min_words:
+            continue
+        length = int(rng.integers(min_words, min(max_words, len(words)) + 1))
+        start = int(rng.integers(0, len(words) - length + 1))
+        queries.append({"text": " ".join(words[start:start + length]), "relevant": [index.ids[row]]})
+        if len(queries) == count:
+            break
+    return queries
+
+
+def embed_queries(service, model, texts, batch_size=64):
+    prefixed = service.prefix_texts(texts, "query: ")
+    vectors = []
+    for start in range(0, len(prefixed), batch_size):
+        token_ids = service.tokenize_texts(model, prefixed[start:start + batch_size])
+        vectors.append(service.embed_token_batch(model, token_ids))
+    return service.normalize_rows(np.concatenate(vectors)).astype(np.float32)
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and recall of dense, lexical and hybrid corpus search")
+    parser.add_argument("index", help="Corpus index snapshot directory (vectors.npy + ids.json)")
+    parser.add_argument("--queries", help="JSONL of {text, relevant: [ids]} queries; sampled from the corpus if omitted")
+    parser.add_argument("--sample", type=int, default=500, help="Queries to sample when --queries is not given")
+    parser.add_argument("--min-words", type=int, default=2)
+    parser.add_argument("--max-words", type=int, default=6)
+    parser.add_argument("--model", help="Model name, defaults to the one recorded in the snapshot")
+    parser.add_argument("--model-path", help="Local weights directory to load instead of the hub")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--candidates", default="50,200,1000", help="Comma-separated hybrid candidate counts")
+    parser.add_argument("--alpha", type=float, default=0.5, help="Dense weight for weighted fusion")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    service = load_service()
+    index = service.VectorIndex(args.index)
+    started = time.perf_counter()
+    # Queries are embedded with the snapshot's own model unless --model is given
+    if not index.load(model_name=args.model):
+        raise SystemExit(f"No corpus index snapshot in {args.index}")
+    print(
+        f"Loaded {len(index)} documents and {len(index.lexical.postings)} terms "
+        f"in {time.perf_counter() - started:.1f}s",
+        file=sys.stderr
+    )
+
+    queries = read_queries(args.queries) if args.queries else sample_queries(
+        index, args.sample, args.min_words, args.max_words, args.seed
+    )
+    if not queries:
+        raise SystemExit("No queries to run")
+    texts = [query["text"] for query in queries]
+
+    with open(Path(args.index) / "ids.json", encoding="utf-8") as f:
+        model_name = args.model or json.load(f).get("model") or service.MODEL_NAME
+    print(f"Embedding {len(queries)} queries with {model_name}...", file=sys.stderr)
+    model = service.load_model(args.model_path or model_name)
+    vectors = embed_queries(service, model, texts)
+
+    modes = [
+        ("dense", lambda text, vector: index.search(vector[None, :], args.k)[0]),
+        ("lexical", lambda text, vector: index.search_lexical([text], args.k)[0]),
+    ]
+    for candidates in (int(value) for value in args.candidates.split(",")):
+        for fusion in ("rrf", "weighted"):
+            modes.append((
+                f"hybrid-{fusion}@{candidates}",
+                lambda text, vector, n=candidates, fusion=fusion: index.search_hybrid(
+                    [text], vector[None, :], args.k, n, fusion, args.alpha
+                )[0]
+            ))
+
+    labelled = any(query["relevant"] for query in queries)
+    reference = None
+    results = []
+    print(f"{'mode':<22} {'p50 ms':>8} {'p99 ms':>8} {'overlap':>8} {f'R@{args.k}':>7} {'MRR':>7}")
+    for name, search in modes:
+        latencies, ranked = [], []
+        for text, vector in zip(texts, vectors):
+            started = time.perf_counter()
+            matches = search(text, vector)
+            latencies.append(time.perf_counter() - started)
+            ranked.append([match["id"] for match in matches])
+        if reference is None:
+            reference = ranked
+
+        overlap = float(np.mean([len(set(r) & set(c)) / max(len(r), 1) for r, c in zip(reference, ranked)]))
+        result = {
+            "mode": name,
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99),
+            "dense_overlap": overlap,
+            "recall": None,
+            "mrr": None,
+        }
+        if labelled:
+            recalls, reciprocal_ranks = [], []
+            for query, ids in zip(queries, ranked):
+                relevant = set(query["relevant"])
+                if not relevant:
+                    continue
+                recalls.append(len(relevant & set(ids)) / len(relevant))
+                rank = next((position for position, doc_id in enumerate(ids, 1) if doc_id in relevant), None)
+                reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+            result["recall"] = float(np.mean(recalls))
+            result["mrr"] = float(np.mean(reciprocal_ranks))
+        results.append(result)
+
+        recall = f"{result['recall']:.3f}" if result["recall"] is not None else "-"
+        mrr = f"{result['mrr']:.3f}" if result["mrr"] is not None else "-"
+        print(f"{name:<22} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {overlap:>8.3f} {recall:>7} {mrr:>7}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "documents": len(index),
+                "queries": len(queries),
+                "k": args.k,
+                "sampled_queries": not args.queries,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
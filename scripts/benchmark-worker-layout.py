@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Pick the worker process x torch thread layout for this host
+Starts the embedding service's launcher once per candidate layout, drives it
+with the /embed load generator and reports throughput, p99 latency and the
+proportional memory (PSS) of the whole process tree, so shared weights are
+only counted once
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+SERVICE_PATH = SCRIPTS_DIR.parent / "embedding-service.py"
+
+
+def load_load_generator():
+    """Import benchmark-embedding.py, whose file name is not a valid module name"""
+    spec = importlib.util.spec_from_file_location("benchmark_embedding", SCRIPTS_DIR / "benchmark-embedding.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def candidate_layouts(cpus, max_workers):
+    """Worker counts that divide the CPUs evenly, each with its share of threads"""
+    return [(workers, cpus // workers) for workers in range(1, min(cpus, max_workers) + 1) if cpus % workers == 0]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_tree(root):
+    """PIDs of ``root`` and all of its descendants"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields after it are fixed
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    pids, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def tree_pss_mb(root):
+    total_kb = 0
+    for pid in process_tree(root):
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+def start_service(port, workers, threads, pinning, timeout):
+    """Launch the service and wait until every worker has finished starting"""
+    command = [
+        sys.executable, str(SERVICE_PATH),
+        "--host", "127.0.0.1",
+        "--port", str(port),
+        "--workers", str(workers),
+        "--threads-per-worker", str(threads),
+        "--pinning", pinning,
+    ]
+    env = {**os.environ, "EMBEDDING_LOAD_MODE": "blocking"}
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    started = threading.Event()
+    ready = [0]
+    log_tail = []
+
+    def read_log():
+        for line in process.stderr:
+            log_tail[:] = (log_tail + [line.rstrip()])[-20:]
+            if "Application startup complete" in line:
+                ready[0] += 1
+                if ready[0] >= workers:
+                    started.set()
+        # The launcher exited before its workers came up
+        process.wait()
+        started.set()
+
+    threading.Thread(target=read_log, daemon=True).start()
+    if not started.wait(timeout) or process.poll() is not None:
+        process.terminate()
+        process.wait()
+        raise RuntimeError("workers did not start:\n" + "\n".join(log_tail[-5:]))
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the best worker x thread layout for the embedding service")
+    parser.add_argument("--cpus", type=int, default=len(os.sched_getaffinity(0)), help="CPUs to divide between workers")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument(
+        "--layouts",
+        help="Comma-separated WORKERSxTHREADS pairs, e.g. 1x32,4x8; defaults to even splits of --cpus"
+    )
+    parser.add_argument("--pinning", default="cores", help="Comma-separated pinning modes to try: none, cores, numa")
+    parser.add_argument("--concurrency", default="16", help="Comma-separated client concurrency levels")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client per level")
+    parser.add_argument("--min-texts", type=int, default=1)
+    parser.add_argument("--max-texts", type=int, default=5)
+    parser.add_argument("--max-p99-ms", type=float, help="Only recommend layouts under this p99 latency")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--json", dest="json_path", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    load_generator = load_load_generator()
+    if args.layouts:
+        layouts = [tuple(int(value) for value in layout.split("x")) for layout in args.layouts.split(",")]
+    else:
+        layouts = candidate_layouts(args.cpus, args.max_workers)
+    levels = [int(value) for value in args.concurrency.split(",")]
+
+    results = []
+    print(f"{'layout':>8} {'pinning':>8} {'conc':>5} {'texts/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'PSS MB':>8} {'errors':>7}")
+    for pinning in args.pinning.split(","):
+        for workers, threads in layouts:
+            port = free_port()
+            try:
+                process = start_service(port, workers, threads, pinning, args.startup_timeout)
+            except RuntimeError as e:
+                print(f"{workers}x{threads} {pinning}: {e}", file=sys.stderr)
+                continue
+
+            try:
+                url = f"http://127.0.0.1:{port}/embed"
+                # One untimed pass warms every worker
+                load_generator.run_level(url, max(levels), 2, args.min_texts, args.max_texts, 60.0)
+                for level in levels:
+                    result = load_generator.run_level(
+                        url, level, args.requests, args.min_texts, args.max_texts, 60.0
+                    )
+                    result.update({
+                        "workers": workers,
+                        "threads_per_worker": threads,
+                        "pinning": pinning,
+                        "pss_mb": tree_pss_mb(process.pid),
+                    })
+                    results.append(result)
+                    p50 = f"{result['p50_ms']:.1f}" if result["p50_ms"] is not None else "-"
+                    p99 = f"{result['p99_ms']:.1f}" if result["p99_ms"] is not None else "-"
+                    print(
+                        f"{f'{workers}x{threads}':>8} {pinning:>8} {level:>5} {result['texts_per_sec']:>9.1f} "
+                        f"{p50:>8} {p99:>8} {result['pss_mb']:>8.0f} {result['errors']:>7}"
+                    )
+            finally:
+                process.terminate()
+                process.wait()
+
+    eligible = [
+        result for result in results
+        if not result["errors"] and result["p99_ms"] is not None
+        and (args.max_p99_ms is None or result["p99_ms"] <= args.max_p99_ms)
+    ]
+    best = max(eligible, key=lambda result: result["texts_per_sec"], default=None)
+    if best is None:
+        print("No layout met the constraints", file=sys.stderr)
+    else:
+        print(
+            f"\nBest: --workers {best['workers']} --threads-per-worker {best['threads_per_worker']} "
+            f"--pinning {best['pinning']} ({best['texts_per_sec']:.1f} texts/s at concurrency {best['concurrency']})"
+        )
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"cpus": args.cpus, "results": results, "best": best}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
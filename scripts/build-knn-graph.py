@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Precompute the "similar supplements" kNN graph for the knowledge graph
+Pulls supplement and mechanism nodes (id, names, descriptions) out of the
+src/data TypeScript modules, embeds each node once with the embedding
+service's own model loading and length-bucketed batching, links every node
+to its k most similar nodes with memory-capped blocked matrix multiplies
+and writes the graph in the service's packed CSR layout (see
+encode_knn_graph in embedding-service.py), which the front end loads with
+a single fetch
+"""
+
+import argparse
+import importlib.util
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SERVICE_PATH = REPO_ROOT / "embedding-service.py"
+
+DEFAULT_SOURCES = [
+    "src/data/supplements",
+    "src/data/neuroplasticity-mechanisms-advanced.ts",
+]
+
+NODE_FIELDS = ("name", "polishName", "description", "polishDescription")
+
+# key: "value" (the value may start on the next line, as biome formats long strings)
+STRING_FIELD = re.compile(r'\b(\w+):\s*"((?:[^"\\]|\\.)*)"', re.MULTILINE)
+
+
+def load_service():
+    """Import embedding-service.py, whose file name is not a valid module name"""
+    spec = importlib.util.spec_from_file_location("embedding_service", SERVICE_PATH)
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+    return service
+
+
+def read_nodes(root):
+    """Objects with an ``id`` and a name or description, in source order
+
+    Fields after an ``id`` belong to that node until the next ``id``; the
+    first value of each field wins, so names of nested entries (active
+    compounds, studies) do not overwrite the node's own.
+    """
+    root = REPO_ROOT / root if not Path(root).is_absolute() else Path(root)
+    files = [root] if root.is_file() else sorted(root.rglob("*.ts"))
+    for path in files:
+        node = None
+        for match in STRING_FIELD.finditer(path.read_text(encoding="utf-8")):
+            field, literal = match.group(1), match.group(2)
+            try:
+                value = json.loads(f'"{literal}"')
+            except json.JSONDecodeError:
+                value = literal
+            if field == "id":
+                if node is not None:
+                    yield node
+                node = {"id": value, "source": str(path.relative_to(REPO_ROOT))}
+            elif node is not None and field in NODE_FIELDS:
+                node.setdefault(field, value)
+        if node is not None:
+            yield node
+
+
+def node_text(node):
+    """Polish and English names and descriptions, which the multilingual model embeds together"""
+    names = [node.get("polishName"), node.get("name")]
+    name = " / ".join(dict.fromkeys(value for value in names if value))
+    descriptions = [node.get("polishDescription"), node.get("description")]
+    return ". ".join([name] + [value for value in descriptions if value])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the supplement kNN graph as a packed CSR file")
+    parser.add_argument("output", help="Where to write the packed graph")
+    parser.add_argument(
+        "--source",
+        action="append",
+        help="TypeScript file or directory to read nodes from; defaults to "
+        + ", ".join(DEFAULT_SOURCES)
+    )
+    parser.add_argument("--k", type=int, default=10, help="Neighbours per node")
+    parser.add_argument("--min-score", type=float, help="Drop edges scoring below this")
+    parser.add_argument(
+        "--memory-mb",
+        type=float,
+        default=256,
+        help="Cap on one score tile plus its top-k selection positions held in memory at once"
+    )
+    parser.add_argument("--model", help="Model name, defaults to the service's model")
+    parser.add_argument("--model-path", help="Local weights directory to load instead of the hub")
+    parser.add_argument("--json", dest="json_path", help="Also write the graph as JSON CSR arrays with node names")
+    args = parser.parse_args()
+
+    nodes, seen = [], set()
+    for source in args.source or DEFAULT_SOURCES:
+        for node in read_nodes(source):
+            # Mechanisms shared by several supplements appear once per profile
+            if node["id"] in seen or not (node.get("description") or node.get("polishDescription")):
+                continue
+            seen.add(node["id"])
+            nodes.append(node)
+    if len(nodes) < 2:
+        raise SystemExit("Found fewer than 2 nodes to link")
+
+    service = load_service()
+    model_name = args.model or service.MODEL_NAME
+    print(f"Embedding {len(nodes)} nodes with {model_name}...", file=sys.stderr)
+    model = service.load_model(args.model_path or model_name)
+
+    started = time.perf_counter()
+    texts = service.prefix_texts([node_text(node) for node in nodes])
+    token_ids = service.tokenize_texts(model, texts)
+    lengths = np.array([len(ids) for ids in token_ids])
+    vectors = None
+    for bucket in service.plan_length_buckets(lengths, service.BATCH_TOKEN_BUDGET, service.MAX_BATCH_SIZE):
+        embedded = service.embed_token_batch(model, [token_ids[i] for i in bucket])
+        if vectors is None:
+            vectors = np.empty((len(nodes), embedded.shape[1]), dtype=np.float32)
+        vectors[bucket] = embedded
+    vectors = service.normalize_rows(vectors)
+    embedded_at = time.perf_counter()
+
+    indptr, indices, scores = service.knn_graph(
+        vectors, args.k, args.min_score, int(args.memory_mb * 1024**2)
+    )
+    ids = [node["id"] for node in nodes]
+    packed = service.encode_knn_graph(ids, indptr, indices, scores)
+    Path(args.output).write_bytes(packed)
+    print(
+        f"Embedded in {embedded_at - started:.1f}s, linked in {time.perf_counter() - embedded_at:.2f}s; "
+        f"wrote {len(ids)} nodes and {len(indices)} edges ({len(packed) / 1024:.1f} KiB) to {args.output}",
+        file=sys.stderr
+    )
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "model": model_name,
+                "ids": ids,
+                "names": [node.get("polishName") or node.get("name") for node in nodes],
+                "indptr": indptr.tolist(),
+                "indices": indices.tolist(),
+                "scores": np.round(scores, 4).tolist(),
+            }, f, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Offline batch embedding for the supplement corpus
+Embeds JSONL records and/or text fields pulled from the src/data TypeScript
+modules with the embedding service's own model loading, prefixing and
+length-bucketed batching, and writes a memory-mappable vector store
+
+The output directory holds:
+  vectors.f32   raw little-endian float32 rows, appended as batches finish
+  records.jsonl one {"id", "hash", "text", "source"} line per row
+  meta.json     model, dimensions and normalization of the rows
+  vectors.npy + ids.json  the same rows in the service's corpus index
+                snapshot layout (usable as EMBEDDING_INDEX_PATH)
+
+Runs are resumable: rows already on disk are kept, a torn final batch is
+trimmed, and records whose content hash is already stored are skipped
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SERVICE_PATH = REPO_ROOT / "embedding-service.py"
+
+DEFAULT_FIELDS = [
+    "description",
+    "polishDescription",
+    "mechanism",
+    "polishMechanism",
+    "indication",
+    "polishIndication",
+]
+
+# key: "value" (the value may start on the next line, as biome formats long strings)
+STRING_FIELD = re.compile(r'\b(\w+):\s*"((?:[^"\\]|\\.)*)"', re.MULTILINE)
+
+
+def load_service():
+    """Import embedding-service.py, whose file name is not a valid module name"""
+    spec = importlib.util.spec_from_file_location("embedding_service", SERVICE_PATH)
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+    return service
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield {
+                "id": str(record.get("id", f"{path}:{line_number}")),
+                "text": record["text"],
+                "source": str(path),
+            }
+
+
+def read_typescript(root, fields, min_length):
+    """Pull string literals of the given fields out of .ts modules under ``root``"""
+    root = Path(root)
+    files = [root] if root.is_file() else sorted(root.rglob("*.ts"))
+    for path in files:
+        source = path.read_text(encoding="utf-8")
+        relative = path.resolve().relative_to(REPO_ROOT) if path.resolve().is_relative_to(REPO_ROOT) else path
+        for match in STRING_FIELD.finditer(source):
+            field, literal = match.group(1), match.group(2)
+            if field not in fields:
+                continue
+            try:
+                text = json.loads(f'"{literal}"')
+            except json.JSONDecodeError:
+                text = literal
+            if len(text) < min_length:
+                continue
+            line = source.count("\n", 0, match.start()) + 1
+            yield {"id": f"{relative}:{line}:{field}", "text": text, "source": str(relative)}
+
+
+class VectorStore:
+    """Append-only vector file plus record sidecar, safe to resume after a crash"""
+
+    def __init__(self, directory, model_name, dimensions, normalize):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.directory / "vectors.f32"
+        self.records_path = self.directory / "records.jsonl"
+        self.meta_path = self.directory / "meta.json"
+        self.dimensions = dimensions
+
+        meta = {"model": model_name, "dimensions": dimensions, "normalize": normalize, "dtype": "<f4"}
+        if self.meta_path.exists():
+            existing = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            if existing != meta:
+                raise SystemExit(f"{self.directory} was built with {existing}, not {meta}; use a new directory")
+        else:
+            self.meta_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+        self.hashes = set()
+        self.rows = self._recover()
+
+    def _recover(self):
+        """Trim both files back to the last row that was fully written to each"""
+        records = []
+        if self.records_path.exists():
+            with open(self.records_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    records.append(line)
+
+        row_bytes = self.dimensions * 4
+        vector_rows = self.vectors_path.stat().st_size // row_bytes if self.vectors_path.exists() else 0
+        rows = min(len(records), vector_rows)
+
+        with open(self.records_path, "wb") as f:
+            f.writelines(records[:rows])
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(rows * row_bytes)
+
+        for line in records[:rows]:
+            self.hashes.add(json.loads(line)["hash"])
+        return rows
+
+    def append(self, records, vectors):
+        # Vectors first: a crash between the two writes leaves extra vector
+        # rows, which the next run trims
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.records_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.rows += len(records)
+        self.hashes.update(record["hash"] for record in records)
+
+    def vectors(self):
+        return np.memmap(self.vectors_path, dtype="<f4", mode="r", shape=(self.rows, self.dimensions))
+
+    def export_snapshot(self, model_name, checksum):
+        """Write vectors.npy and ids.json in the corpus index snapshot layout
+
+        ``checksum`` is the service's snapshot_checksum, recorded in ids.json
+        so the service can tell a torn export from a complete one.
+        """
+        vectors_tmp = self.directory / "vectors.tmp.npy"
+        ids_tmp = self.directory / "ids.tmp.json"
+
+        if self.rows:
+            output = np.lib.format.open_memmap(
+                vectors_tmp, mode="w+", dtype=np.float32, shape=(self.rows, self.dimensions)
+            )
+            source = self.vectors()
+            for start in range(0, self.rows, 65536):
+                output[start:start + 65536] = source[start:start + 65536]
+            output.flush()
+            digest = checksum(output)
+            del output
+        else:
+            empty = np.empty((0, self.dimensions), dtype=np.float32)
+            np.save(vectors_tmp, empty)
+            digest = checksum(empty)
+
+        ids, payloads = [], []
+        with open(self.records_path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(record["id"])
+                payloads.append({"text": record["text"], "metadata": {"source": record["source"]}})
+        with open(ids_tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": model_name, "checksum": digest, "ids": ids, "payloads": payloads}, f, ensure_ascii=False)
+
+        os.replace(vectors_tmp, self.directory / "vectors.npy")
+        os.replace(ids_tmp, self.directory / "ids.json")
+
+
+def content_hash(model_name, normalize, text):
+    return hashlib.sha256(f"{model_name}\0{int(normalize)}\0{text}".encode("utf-8")).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed a corpus offline into a memory-mappable vector store")
+    parser.add_argument("output", help="Output directory; reusing it resumes the previous run")
+    parser.add_argument("--jsonl", action="append", default=[], help="JSONL file of {id, text} records")
+    parser.add_argument("--ts", action="append", default=[], help="TypeScript file or directory to extract text fields from")
+    parser.add_argument("--fields", default=",".join(DEFAULT_FIELDS), help="Comma-separated TypeScript fields to embed")
+    parser.add_argument("--min-length", type=int, default=40, help="Skip extracted strings shorter than this")
+    parser.add_argument("--model", help="Model name, defaults to the service's model")
+    parser.add_argument("--model-path", help="Local weights directory to load instead of the hub")
+    parser.add_argument("--backend", help="Inference backend, defaults to EMBEDDING_BACKEND")
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="Torch intra-op threads")
+    parser.add_argument("--chunk-size", type=int, default=512, help="Texts embedded and flushed per step")
+    parser.add_argument("--token-budget", type=int, help="Padded tokens per forward pass")
+    parser.add_argument("--no-normalize", action="store_true", help="Store raw rather than unit-length vectors")
+    args = parser.parse_args()
+
+    if not args.jsonl and not args.ts:
+        parser.error("give at least one --jsonl or --ts source")
+
+    service = load_service()
+    service.torch.set_num_threads(args.threads)
+    model_name = args.model or service.MODEL_NAME
+    normalize = not args.no_normalize
+    token_budget = args.token_budget or service.BATCH_TOKEN_BUDGET
+
+    fields = set(args.fields.split(","))
+    records = []
+    for path in args.jsonl:
+        records.extend(read_jsonl(path))
+    for path in args.ts:
+        records.extend(read_typescript(path, fields, args.min_length))
+
+    print(f"Loading {model_name} with {args.threads} threads...", file=sys.stderr)
+    model = service.load_model(args.model_path or model_name, args.backend or service.INFERENCE_BACKEND)
+    store = VectorStore(args.output, model_name, model.get_sentence_embedding_dimension(), normalize)
+
+    pending = []
+    seen = set(store.hashes)
+    for record, text in zip(records, service.prefix_texts([record["text"] for record in records])):
+        digest = content_hash(model_name, normalize, text)
+        if digest in seen:
+            continue
+        seen.add(digest)
+        pending.append(({**record, "hash": digest}, text))
+
+    print(
+        f"{len(records)} records, {store.rows} already stored, {len(pending)} to embed",
+        file=sys.stderr
+    )
+
+    started = time.perf_counter()
+    for start in range(0, len(pending), args.chunk_size):
+        chunk = pending[start:start + args.chunk_size]
+        token_ids = service.tokenize_texts(model, [text for _, text in chunk])
+        lengths = np.array([len(ids) for ids in token_ids])
+
+        vectors = None
+        for bucket in service.plan_length_buckets(lengths, token_budget, len(chunk)):
+            embedded = service.embed_token_batch(model, [token_ids[i] for i in bucket])
+            if vectors is None:
+                vectors = np.empty((len(chunk), embedded.shape[1]), dtype=np.float32)
+            vectors[bucket] = embedded
+        if normalize:
+            vectors = service.normalize_rows(vectors)
+
+        store.append([record for record, _ in chunk], vectors)
+        done = start + len(chunk)
+        rate = done / (time.perf_counter() - started)
+        print(f"{done}/{len(pending)} embedded ({rate:.1f} texts/s)", file=sys.stderr)
+
+    store.export_snapshot(model_name, service.snapshot_checksum)
+    print(f"Wrote {store.rows} vectors to {store.directory}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Find copy-pasted and near-duplicate text in the src/data TypeScript modules
+Extracts text fields the same way scripts/embed-corpus.py does, embeds each
+distinct string once and reports groups of strings whose cosine similarity
+reaches the threshold, with the file, line and field of every copy, using
+the embedding service's blocked duplicate detection
+"""
+
+import argparse
+import importlib.util
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+SERVICE_PATH = SCRIPTS_DIR.parent / "embedding-service.py"
+
+
+def load_script(name, path):
+    """Import a sibling file whose name is not a valid module name"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report duplicate and near-duplicate text in the TypeScript data")
+    parser.add_argument("sources", nargs="*", default=["src/data"], help="TypeScript files or directories")
+    parser.add_argument("--fields", help="Comma-separated fields to compare, defaults to embed-corpus's")
+    parser.add_argument("--min-length", type=int, default=40, help="Skip strings shorter than this")
+    parser.add_argument("--threshold", type=float, default=0.97, help="Cosine similarity that counts as a duplicate")
+    parser.add_argument("--exact-only", action="store_true", help="Only report identical strings, without a model")
+    parser.add_argument("--model", help="Model name, defaults to the service's model")
+    parser.add_argument("--model-path", help="Local weights directory to load instead of the hub")
+    parser.add_argument("--json", dest="json_path", help="Write the groups to this JSON file")
+    args = parser.parse_args()
+
+    embed_corpus = load_script("embed_corpus", SCRIPTS_DIR / "embed-corpus.py")
+    fields = set(args.fields.split(",")) if args.fields else set(embed_corpus.DEFAULT_FIELDS)
+    records = [
+        record
+        for source in args.sources
+        for record in embed_corpus.read_typescript(source, fields, args.min_length)
+    ]
+
+    # Identical strings share one row, so exact copies cost a single embedding
+    locations = {}
+    for record in records:
+        locations.setdefault(record["text"].strip(), []).append(record["id"])
+    texts = list(locations)
+    print(f"{len(records)} strings, {len(texts)} distinct", file=sys.stderr)
+
+    if args.exact_only or len(texts) < 2:
+        labels = np.arange(len(texts))
+    else:
+        service = load_script("embedding_service", SERVICE_PATH)
+        model = service.load_model(args.model_path or args.model or service.MODEL_NAME)
+        token_ids = service.tokenize_texts(model, service.prefix_texts(texts))
+        lengths = np.array([len(ids) for ids in token_ids])
+        vectors = None
+        for bucket in service.plan_length_buckets(lengths, service.BATCH_TOKEN_BUDGET, service.MAX_BATCH_SIZE):
+            embedded = service.embed_token_batch(model, [token_ids[i] for i in bucket])
+            if vectors is None:
+                vectors = np.empty((len(texts), embedded.shape[1]), dtype=np.float32)
+            vectors[bucket] = embedded
+        labels = service.duplicate_groups(service.normalize_rows(vectors), args.threshold)
+
+    members = {}
+    for row, label in enumerate(labels.tolist()):
+        members.setdefault(label, []).append(row)
+    groups = []
+    for rows in members.values():
+        copies = [{"text": texts[row], "locations": locations[texts[row]]} for row in rows]
+        if sum(len(copy["locations"]) for copy in copies) > 1:
+            groups.append(copies)
+    groups.sort(key=lambda copies: -sum(len(copy["locations"]) for copy in copies))
+
+    for copies in groups:
+        exact = len(copies) == 1
+        print(f"\n{'identical' if exact else 'near-duplicate'} x{sum(len(copy['locations']) for copy in copies)}:")
+        for copy in copies:
+            print(f"  {copy['text'][:100]!r}")
+            for location in copy["locations"]:
+                print(f"    {location}")
+    print(f"\n{len(groups)} duplicate groups", file=sys.stderr)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"threshold": args.threshold, "groups": groups}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
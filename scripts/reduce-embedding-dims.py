@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Fit and evaluate reduced-dimension embeddings
+``fit`` learns a PCA projection from a corpus vector store (the output of
+scripts/embed-corpus.py) and writes it as pca.npz for the service to load
+next to the model. ``evaluate`` measures, for each output_dim, how many of
+the full-dimension top-k neighbours survive truncation and PCA reduction,
+next to the bytes each vector then costs
+"""
+
+import argparse
+import importlib.util
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+SERVICE_PATH = Path(__file__).resolve().parent.parent / "embedding-service.py"
+
+
+def load_service():
+    """Import embedding-service.py, whose file name is not a valid module name"""
+    spec = importlib.util.spec_from_file_location("embedding_service", SERVICE_PATH)
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+    return service
+
+
+def load_vectors(store):
+    path = Path(store)
+    if path.is_dir():
+        path = path / "vectors.npy"
+    return np.load(path, mmap_mode="r")
+
+
+def fit(args):
+    vectors = load_vectors(args.store)
+    rng = np.random.default_rng(args.seed)
+    if len(vectors) > args.sample:
+        rows = np.sort(rng.choice(len(vectors), args.sample, replace=False))
+        vectors = vectors[rows]
+    vectors = np.asarray(vectors, dtype=np.float64)
+
+    mean = vectors.mean(axis=0)
+    centered = vectors - mean
+    # Eigen-decompose the d x d covariance rather than SVD the n x d sample
+    covariance = centered.T @ centered / max(len(vectors) - 1, 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1][:args.components]
+    components = eigenvectors[:, order].T
+    explained = eigenvalues[order] / eigenvalues.sum()
+
+    np.savez(
+        args.output,
+        mean=mean.astype(np.float32),
+        components=components.astype(np.float32),
+        explained_variance_ratio=explained.astype(np.float32)
+    )
+    print(
+        f"Fitted {len(components)} components on {len(vectors)} vectors; "
+        f"they explain {explained.sum():.1%} of the variance",
+        file=sys.stderr
+    )
+    for dim in (64, 128, 256, 512):
+        if dim <= len(components):
+            print(f"  {dim:>4} components: {explained[:dim].sum():.1%}", file=sys.stderr)
+
+
+def top_k(queries, corpus, k, exclude, block=1024):
+    """Indices of each query's k best corpus rows, skipping the query's own row"""
+    neighbours = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), block):
+        scores = queries[start:start + block] @ corpus.T
+        rows = np.arange(len(scores))
+        scores[rows, exclude[start:start + block]] = -np.inf
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1)
+        neighbours[start:start + block] = np.take_along_axis(best, order, axis=1)
+    return neighbours
+
+
+def recall(reference, candidate):
+    k = reference.shape[1]
+    return float(np.mean([len(set(r) & set(c)) / k for r, c in zip(reference, candidate)]))
+
+
+def evaluate(args):
+    service = load_service()
+    corpus = np.asarray(load_vectors(args.store), dtype=np.float32)
+    full_dim = corpus.shape[1]
+    dims = [int(value) for value in args.dims.split(",") if int(value) <= full_dim]
+    k_values = [int(value) for value in args.k.split(",")]
+    max_k = max(k_values)
+    if max_k >= len(corpus):
+        raise SystemExit(f"k={max_k} needs more than {len(corpus)} corpus vectors")
+
+    projection = service.load_projection(args.pca)
+    if args.pca and projection is None:
+        raise SystemExit(f"No PCA projection at {args.pca}")
+
+    # Corpus rows double as queries; each query's own row is excluded from its neighbours
+    rng = np.random.default_rng(args.seed)
+    query_rows = np.sort(rng.choice(len(corpus), min(args.queries, len(corpus)), replace=False))
+    reference = top_k(corpus[query_rows], corpus, max_k, query_rows)
+
+    methods = [("truncate", None)]
+    if projection is not None:
+        methods.append(("pca", projection))
+
+    results = []
+    print(f"{'method':<9} {'dim':>5} {'fp32 B':>7} {'fp16 B':>7} " + " ".join(f"{f'R@{k}':>7}" for k in k_values))
+    for method, method_projection in methods:
+        for dim in dims:
+            if method_projection is not None and dim > len(method_projection["components"]):
+                continue
+            reduced = service.reduce_dimensions(corpus, dim, method_projection)
+            found = top_k(reduced[query_rows], reduced, max_k, query_rows)
+            result = {
+                "method": method,
+                "output_dim": dim,
+                "bytes_float32": dim * 4,
+                "bytes_float16": dim * 2,
+                "recall": {str(k): recall(reference[:, :k], found[:, :k]) for k in k_values},
+            }
+            results.append(result)
+            print(
+                f"{method:<9} {dim:>5} {dim * 4:>7} {dim * 2:>7} "
+                + " ".join(f"{result['recall'][str(k)]:>7.3f}" for k in k_values)
+            )
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "corpus_size": len(corpus),
+                "queries": len(query_rows),
+                "full_dim": full_dim,
+                "results": results,
+            }, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit and evaluate reduced-dimension embeddings")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fit_parser = subparsers.add_parser("fit", help="Fit a PCA projection on a corpus vector store")
+    fit_parser.add_argument("store", help="embed-corpus output directory or a vectors.npy file")
+    fit_parser.add_argument("--output", required=True, help="Where to write pca.npz, usually the model's weights directory")
+    fit_parser.add_argument("--components", type=int, default=512, help="Components to keep; the largest servable output_dim")
+    fit_parser.add_argument("--sample", type=int, default=200000, help="Fit on at most this many vectors")
+    fit_parser.add_argument("--seed", type=int, default=0)
+    fit_parser.set_defaults(handler=fit)
+
+    evaluate_parser = subparsers.add_parser(
+        "evaluate",
+        help="Recall@k of truncated and PCA-reduced vectors against full-dimension neighbours"
+    )
+    evaluate_parser.add_argument("store", help="embed-corpus output directory or a vectors.npy file")
+    evaluate_parser.add_argument(
+        "--pca",
+        help="pca.npz to evaluate as well; fit it on a different store than this one for an unbiased figure"
+    )
+    evaluate_parser.add_argument("--dims", default="64,128,256,384,512", help="Comma-separated output_dim values")
+    evaluate_parser.add_argument("--k", default="1,10,100", help="Comma-separated k values for recall@k")
+    evaluate_parser.add_argument("--queries", type=int, default=1000, help="Corpus rows sampled as queries")
+    evaluate_parser.add_argument("--seed", type=int, default=0)
+    evaluate_parser.add_argument("--json", dest="json_path", help="Write results to this JSON file")
+    evaluate_parser.set_defaults(handler=evaluate)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
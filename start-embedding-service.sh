@@ -40,9 +40,10 @@ MAX_ATTEMPTS=30
 ATTEMPT=1
 
 while [ $ATTEMPT -le $MAX_ATTEMPTS ]; do
-    echo "🔍 Health check attempt $ATTEMPT/$MAX_ATTEMPTS..."
+    echo "🔍 Readiness check attempt $ATTEMPT/$MAX_ATTEMPTS..."
 
-    if curl -f http://localhost:8001/health &> /dev/null; then
+    # /readyz answers 200 only once the model is loaded and warmed up
+    if curl -f http://localhost:8001/readyz &> /dev/null; then
         echo "✅ Embedding service is ready!"
         echo ""
         echo "🌐 Service endpoints:"